@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import time
+
+import torch
+
+from benchmarks.inference import versions
+from data.synthetic import write_synthetic_data
+from models.ionet.distributed import default_config, launch, prepare_features
+
+
+def max_parameter_difference(checkpoint, reference):
+    state = torch.load(checkpoint)['state_dict']
+    reference_state = torch.load(reference)['state_dict']
+    return max((state[name] - reference_state[name]).abs().max().item() for name in state)
+
+
+def main(args):
+    if not os.path.exists(args.cache):
+        os.makedirs(args.cache)
+    osd_path = args.input
+    if osd_path is None:
+        osd_path = os.path.join(args.cache, 'synthetic', 'osd0')
+        if not os.path.exists(os.path.join(osd_path, 'entries.csv')):
+            write_synthetic_data(os.path.join(args.cache, 'synthetic'), osds=1, n_requests=args.requests)
+    features = prepare_features(osd_path, os.path.join(args.cache, 'features', 'ddp'))
+    cpus = os.cpu_count() or 1
+
+    report = {'meta': dict(versions(), model_class=args.model_class, batch_size=args.batch_size, epochs=args.epochs),
+              'runs': []}
+    reference = None
+    for port_offset, workers in enumerate(args.workers):
+        checkpoint = os.path.join(args.cache, f'ddp_{workers}.pt')
+        run_report = os.path.join(args.cache, f'ddp_{workers}.json')
+        threads = args.threads if args.threads is not None else max(1, cpus // workers)
+        config = default_config(features=features, threshold=args.threshold, model_class=args.model_class,
+                                batch_size=args.batch_size, epochs=args.epochs, threads=threads,
+                                checkpoint=checkpoint, report=run_report, master_port=args.master_port + port_offset)
+        start = time.perf_counter()
+        launch(workers, config)
+        wall_seconds = time.perf_counter() - start
+        with open(run_report, 'r') as file:
+            run = json.load(file)
+        run.update(workers=workers, threads_per_worker=threads, wall_seconds=wall_seconds,
+                   samples_per_second=run['samples'] / run['train_seconds'])
+        if reference is None:
+            reference = checkpoint
+            baseline = run['train_seconds']
+        run['speedup'] = baseline / run['train_seconds']
+        run['efficiency'] = run['speedup'] / (workers / args.workers[0])
+        run['max_param_diff'] = max_parameter_difference(checkpoint, reference)
+        report['runs'].append(run)
+        print(f"{workers} workers x {threads} threads: train {run['train_seconds']:.2f}s | "
+              f"{run['samples_per_second']:.0f} samples/s | speedup {run['speedup']:.2f} | "
+              f"max param diff vs {args.workers[0]} worker(s) {run['max_param_diff']:.2e}")
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='data-parallel training scaling benchmark')
+    parser.add_argument('-i', '--input', metavar='input',
+                        default=None, dest='input',
+                        help='Pre-processed OSD folder (default: a cached synthetic trace).')
+    parser.add_argument('-o', '--output', default='bench_ddp_scaling.json', dest='output')
+    parser.add_argument('--cache', default='.bench_cache', dest='cache')
+    parser.add_argument('-n', '--requests', type=int, default=100_000, dest='requests')
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 2, 4, 8], dest='workers')
+    parser.add_argument('--threads', type=int, default=None, dest='threads',
+                        help='Torch threads per worker (default: cores / workers).')
+    parser.add_argument('-t', '--threshold', type=int, default=300_000, dest='threshold')
+    parser.add_argument('--model-class', default='ModelC', dest='model_class')
+    parser.add_argument('--batch-size', type=int, default=256, dest='batch_size')
+    parser.add_argument('--epochs', type=int, default=2, dest='epochs')
+    parser.add_argument('--master-port', type=int, default=29500, dest='master_port')
+    main(parser.parse_args())
@@ -0,0 +1,245 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from experiments.runner import limit_threads
+from models.ionet.registry import DNN_MODELS, SKLEARN_MODELS, sklearn_model_class
+
+BATCH_SIZES = [1, 4, 16, 64, 256, 1024, 4096]
+PERCENTILES = [50, 90, 99, 99.9]
+
+# Metrics shown by --compare; lower is better for all but throughput.
+COMPARE_METRICS = ['load_seconds', 'model_rss_bytes', 'single_p50_us', 'single_p99_us']
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def prepare_features(args):
+    from data.featurized import featurize_osd, is_featurized
+    from data.synthetic import write_synthetic_data
+    osd_path = args.input
+    if osd_path is None:
+        synthetic_path = os.path.join(args.cache, 'synthetic')
+        osd_path = os.path.join(synthetic_path, 'osd0')
+        if not os.path.exists(os.path.join(osd_path, 'entries.csv')):
+            write_synthetic_data(synthetic_path, osds=1, n_requests=args.requests, seed=args.seed)
+    features_path = os.path.join(args.cache, 'features', os.path.basename(os.path.normpath(osd_path)))
+    if args.input is not None or not is_featurized(features_path):
+        featurize_osd(osd_path, features_path)
+    return features_path
+
+
+def load_split(features_path, threshold, stages):
+    from data.featurized import load_featurized, bin_classification_datasets
+    features, latency, columns = load_featurized(features_path)
+    if threshold is None:
+        threshold = int(np.median(latency))
+    return bin_classification_datasets(features, latency, threshold, stages=stages, columns=columns), threshold
+
+
+def train_model(name, features_path, threshold, model_path, epochs):
+    (train_dataset, test_dataset), _ = load_split(features_path, threshold, stages=('train', 'test'))
+    start = time.perf_counter()
+    if name in SKLEARN_MODELS:
+        model = sklearn_model_class(name)(None)
+        model.train_dataset, model.test_dataset = train_dataset, test_dataset
+        model.train()
+    else:
+        from torch.utils.data import DataLoader
+        from models.ionet import dense_dnn
+        model = dense_dnn.IONETDenseDNN(None, model_class=getattr(dense_dnn, name), batch_size=256,
+                                        output=io.StringIO(), datasets=(train_dataset, None, test_dataset))
+        train_loader = DataLoader(train_dataset, batch_size=256, shuffle=True)
+        for _ in range(epochs):
+            model.train_epoch(train_loader)
+    train_seconds = time.perf_counter() - start
+    model.save(model_path)
+    return train_seconds
+
+
+def load_predictor(name, model_path):
+    if name in SKLEARN_MODELS:
+        model = sklearn_model_class(name)(None)
+        model.load(model_path)
+        return model.predict
+    import torch
+    from models.ionet.dense_dnn import IONETDenseDNN
+    model = IONETDenseDNN.load_model(model_path)
+
+    def predict(features):
+        with torch.no_grad():
+            return model(torch.from_numpy(features)).argmax(dim=1).numpy()
+
+    return predict
+
+
+def measure_model(name, model_path, features_path, threshold, threads, batch_sizes, iterations, min_seconds):
+    # Runs in a fresh process so load time and resident memory are not polluted by other models.
+    if name not in SKLEARN_MODELS:
+        import torch
+        torch.set_num_threads(threads)
+    (test_dataset,), _ = load_split(features_path, threshold, stages=('test',))
+    features, _ = test_dataset.as_arrays()
+    features = np.ascontiguousarray(np.resize(features, (max(len(features), max(batch_sizes)), features.shape[1])))
+    baseline_rss = rss_bytes()
+
+    start = time.perf_counter()
+    predict = load_predictor(name, model_path)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    predict(features[:1])
+    first_prediction_seconds = time.perf_counter() - start
+    result = {
+        'model_bytes': os.path.getsize(model_path),
+        'load_seconds': load_seconds,
+        'first_prediction_seconds': first_prediction_seconds,
+        'model_rss_bytes': rss_bytes() - baseline_rss,
+    }
+
+    timings = np.empty(iterations, dtype=np.int64)
+    for i in range(iterations):
+        sample = features[i % len(features)][None, :]
+        start = time.perf_counter_ns()
+        predict(sample)
+        timings[i] = time.perf_counter_ns() - start
+    for percentile, value in zip(PERCENTILES, np.percentile(timings, PERCENTILES)):
+        result[f'single_p{percentile:g}_us'] = value / 1000
+    result['single_mean_us'] = timings.mean() / 1000
+
+    result['throughput'] = {}
+    for batch_size in batch_sizes:
+        runs, samples, elapsed = 0, 0, 0
+        while runs < 3 or elapsed < min_seconds:
+            offset = (runs * batch_size) % (len(features) - batch_size + 1)
+            start = time.perf_counter()
+            predict(features[offset:offset + batch_size])
+            elapsed += time.perf_counter() - start
+            runs += 1
+            samples += batch_size
+        result['throughput'][str(batch_size)] = {
+            'samples_per_second': samples / elapsed,
+            'batch_ms': 1000 * elapsed / runs,
+        }
+    result['peak_rss_bytes'] = peak_rss_bytes()
+    return result
+
+
+def versions():
+    info = {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+    for package in ['numpy', 'pandas', 'sklearn', 'torch']:
+        try:
+            info[package] = __import__(package).__version__
+        except ImportError:
+            info[package] = None
+    return info
+
+
+def compare(report, baseline):
+    lines = [f"{'model':<22}{'metric':<28}{'baseline':>14}{'current':>14}{'change':>10}"]
+    for name, result in report['models'].items():
+        if name not in baseline['models']:
+            continue
+        old = baseline['models'][name]
+        rows = [(metric, old.get(metric), result.get(metric)) for metric in COMPARE_METRICS]
+        for batch_size, throughput in result['throughput'].items():
+            old_throughput = old.get('throughput', {}).get(batch_size, {})
+            rows.append((f'samples/s @ batch {batch_size}', old_throughput.get('samples_per_second'),
+                         throughput['samples_per_second']))
+        for metric, old_value, new_value in rows:
+            if not old_value or new_value is None:
+                continue
+            lines.append(f"{name:<22}{metric:<28}{old_value:>14.4g}{new_value:>14.4g}"
+                         f"{100 * (new_value - old_value) / old_value:>+9.1f}%")
+    return '\n'.join(lines)
+
+
+def main(args):
+    if not os.path.exists(args.cache):
+        os.makedirs(args.cache)
+    models_path = os.path.join(args.cache, 'models')
+    if not os.path.exists(models_path):
+        os.makedirs(models_path)
+    features_path = prepare_features(args)
+    (train_dataset,), threshold = load_split(features_path, args.threshold, stages=('train',))
+
+    report = {
+        'meta': dict(versions(), created=time.strftime('%Y-%m-%dT%H:%M:%S'), threads=args.threads,
+                     threshold=threshold, train_rows=len(train_dataset), features=train_dataset.input_size(),
+                     iterations=args.iterations, batch_sizes=args.batch_sizes),
+        'models': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    for name in args.models:
+        model_path = os.path.join(models_path, f'{name}.pt' if name in DNN_MODELS else f'{name}.pkl')
+        train_seconds = None
+        if args.retrain or not os.path.exists(model_path):
+            train_seconds = train_model(name, features_path, threshold, model_path, args.epochs)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=limit_threads,
+                                 initargs=(args.threads,)) as executor:
+            result = executor.submit(measure_model, name, model_path, features_path, threshold, args.threads,
+                                     args.batch_sizes, args.iterations, args.min_seconds).result()
+        result['train_seconds'] = train_seconds
+        report['models'][name] = result
+        print(f"{name}: load {1000 * result['load_seconds']:.1f}ms | "
+              f"p50 {result['single_p50_us']:.1f}us | p99 {result['single_p99_us']:.1f}us | "
+              f"{result['throughput'][str(max(args.batch_sizes))]['samples_per_second']:.0f} samples/s "
+              f"@ batch {max(args.batch_sizes)} | rss {result['model_rss_bytes'] / 2 ** 20:.1f}MiB")
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    if args.compare is not None:
+        with open(args.compare, 'r') as file:
+            print(compare(report, json.load(file)))
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description='inference benchmark for IONET models')
+    parser.add_argument('-i', '--input', metavar='input',
+                        default=None, dest='input',
+                        help='Pre-processed OSD folder (default: a cached synthetic trace).')
+    parser.add_argument('-o', '--output', metavar='output',
+                        default='bench_inference.json', dest='output',
+                        help='Report path (json).')
+    parser.add_argument('--cache', default='.bench_cache', dest='cache',
+                        help='Folder for the synthetic trace, features and trained models.')
+    parser.add_argument('--compare', default=None, dest='compare',
+                        help='Previous report to diff against.')
+    parser.add_argument('-m', '--models', nargs='+', default=list(SKLEARN_MODELS.keys()) + DNN_MODELS,
+                        choices=list(SKLEARN_MODELS.keys()) + DNN_MODELS, dest='models')
+    parser.add_argument('-t', '--threshold', type=int, default=None, dest='threshold',
+                        help='Latency threshold (default: median latency).')
+    parser.add_argument('-n', '--requests', type=int, default=100_000, dest='requests',
+                        help='Size of the synthetic trace.')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=BATCH_SIZES, dest='batch_sizes')
+    parser.add_argument('--iterations', type=int, default=2000, dest='iterations',
+                        help='Single-sample predictions timed for the latency percentiles.')
+    parser.add_argument('--min-seconds', type=float, default=0.5, dest='min_seconds',
+                        help='Minimum time spent per batch size.')
+    parser.add_argument('--threads', type=int, default=1, dest='threads')
+    parser.add_argument('--epochs', type=int, default=3, dest='epochs')
+    parser.add_argument('--retrain', action='store_true', dest='retrain')
+    parser.add_argument('--seed', type=int, default=0, dest='seed')
+    main(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    cli()
@@ -8,13 +8,35 @@ from sklearn.model_selection import train_test_split
 from torch.utils.data import Dataset
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
 
+from data.ops_index import OpsIndex
+from data.pre_process import RD, WR
+from data.pruning import FeaturePruner
+from utils.profiler import profiled, stage
+
+
+# Request stamps are in nanoseconds.
+STAMPS_PER_MS = 1_000_000
+
 
 class IODataSet(Dataset):
     def __init__(self, path, stage='train', val_size=0, train_size=0.8, shuffle=False, seed=12,
-                 exclude_normalization=None):
+                 exclude_normalization=None, type_encoding='onehot', prune=False, schema=None,
+                 load_windows=(1, 10, 100), arrival_features=False):
         if stage not in ['train', 'val', 'test']:
             raise ArgumentError(f'Unknown stage {stage}.')
+        if type_encoding not in ['onehot', 'ordinal']:
+            raise ArgumentError(f'Unknown type encoding {type_encoding}.')
         self.path = path
+        self.type_encoding = type_encoding
+        # Trailing windows (ms) for the recent load features.
+        self.load_windows = load_windows
+        # Only features known when the request arrives: no queue state (it is observed at dequeue) and load windows
+        # ending at the enqueue stamp. Needed to score requests before they are scheduled, e.g. in simulation.
+        self.arrival_features = arrival_features
+        # Column pruning: `schema` (a FeaturePruner or a saved schema path) is applied as is, otherwise `prune`
+        # fits a new schema on the training slice.
+        self.prune = prune
+        self.pruner = FeaturePruner.load(schema) if isinstance(schema, str) else schema
         self.stage = stage
         self.val_size = val_size
         self.train_size = train_size
@@ -22,19 +44,28 @@ class IODataSet(Dataset):
         self.seed = seed
         self.entries = None
         self.ops = None
+        self.ops_index = None
         self.data = None
         self.labels = None
+        # Per-row sampling weights, set when the entries were down-sampled during pre-processing.
+        self.weights = None
+        self.return_weights = False
         self.len = 0
         self.op_types = None
         self.entry_types = None
-        self.entry_log_transform_features = ['cost', 'latency']
-        self.entry_standard_scale_features = ['cost', 'latency', 'ops_len']
+        self.entry_log_transform_features = ['cost', 'latency', 'queue_wait', 'queue_depth', 'in_flight']
+        self.entry_standard_scale_features = ['cost', 'latency', 'ops_len', 'queue_wait', 'queue_depth', 'in_flight']
         self.entry_minmax_scale_features = ['priority']
         self.ops_log_transform_features = ['len']
         self.ops_standard_scale_features = ['len']
         self.ops_minmax_scale_features = ['off']
+        for window in load_windows:
+            self.entry_log_transform_features += [f'load_{window}ms_requests', f'load_{window}ms_bytes']
+            self.entry_standard_scale_features += [f'load_{window}ms_requests', f'load_{window}ms_bytes']
         if exclude_normalization is None:
             exclude_normalization = []
+        if arrival_features:
+            exclude_normalization = exclude_normalization + ['queue_wait', 'queue_depth', 'in_flight']
         for exclude_column in exclude_normalization:
             if exclude_column in self.entry_log_transform_features:
                 self.entry_log_transform_features.remove(exclude_column)
@@ -60,11 +91,19 @@ class IODataSet(Dataset):
     def input_size(self):
         return len(self.data.columns)
 
+    @profiled('IODataSet.load_data')
     def load_data(self):
         entries_path = os.path.join(self.path, 'entries.csv')
         self.entries = pd.read_csv(entries_path)
-        ops_path = os.path.join(self.path, 'ops.csv')
-        self.ops = pd.read_csv(ops_path)
+        if OpsIndex.exists(self.path):
+            self.ops_index = OpsIndex.load(self.path)
+        if self.ops_index is not None and len(self.ops_index) == len(self.entries):
+            # Op columns only: with the CSR index, ops are matched to their entries row by position.
+            self.ops = pd.DataFrame({name: np.asarray(values) for name, values in self.ops_index.columns.items()})
+        else:
+            self.ops_index = None
+            ops_path = os.path.join(self.path, 'ops.csv')
+            self.ops = pd.read_csv(ops_path)
         entry_type_path = os.path.join(self.path, 'msg_op_types.json')
         with open(entry_type_path, "r") as file:
             self.entry_types = json.load(file)
@@ -95,91 +134,315 @@ class IODataSet(Dataset):
         df[columns] = (df[columns] - min_vals) / (max_vals - min_vals)  # MinMax Scaling formula
         return df
 
+    # Number of events at or before each time in `times`, weighted: a binary search in the sorted event stamps and
+    # a lookup in the prefix sums of their weights.
+    @staticmethod
+    def weighted_count(stamps, weights, times, side='right'):
+        order = np.argsort(stamps, kind='stable')
+        prefix_sum = np.concatenate([[0], np.cumsum(weights[order])])
+        return prefix_sum[np.searchsorted(stamps[order], times, side=side)]
+
+    # Queue state seen by each request when it is dequeued, from the stamps that are dropped below. On a down-sampled
+    # trace every kept request stands for `sample_weight` requests, so the counts estimate those of the full trace.
+    @staticmethod
+    def add_queue_features(df):
+        recv = df['recv_stamp'].to_numpy()
+        enqueue = df['enqueue_stamp'].to_numpy()
+        dequeue = df['dequeue_stamp'].to_numpy()
+        dequeue_end = df['dequeue_end_stamp'].to_numpy()
+        weights = df['sample_weight'].to_numpy() if 'sample_weight' in df.columns else np.ones(len(df))
+        df['queue_wait'] = np.maximum(dequeue - enqueue, 0)
+        # Sweep line: queued is enqueued but not yet dequeued, in flight is received but not yet completed (only
+        # completions up to the dequeue time are used, never the request's own end). With fractional weights the
+        # difference of the prefix sums can cancel to slightly below 0, which log1p would turn into NaN.
+        df['queue_depth'] = np.maximum(IODataSet.weighted_count(enqueue, weights, dequeue)
+                                       - IODataSet.weighted_count(dequeue, weights, dequeue), 0)
+        df['in_flight'] = np.maximum(IODataSet.weighted_count(recv, weights, dequeue)
+                                     - IODataSet.weighted_count(dequeue_end, weights, dequeue), 0)
+        return df
+
+    # Load on the OSD over the last `window` ms before each request: requests, bytes of their ops and the share of
+    # read ops. Window bounds are binary searches in the sorted timestamps and the sums are prefix sum differences,
+    # so the cost does not depend on the window length. Requests are weighted by `sample_weight` like above.
+    # `per_entry` holds the bytes, reads and writes of each entries row.
+    @staticmethod
+    def add_load_features(entries, per_entry, windows, anchor='timestamp'):
+        timestamps = entries[anchor].to_numpy()
+        weights = entries['sample_weight'].to_numpy() if 'sample_weight' in entries.columns else np.ones(len(entries))
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+        prefix_sums = {name: np.concatenate([[0], np.cumsum((weights * per_entry[name])[order])])
+                       for name in ['requests', 'bytes', 'reads', 'writes']}
+        end = np.searchsorted(timestamps, timestamps, side='left')  # strictly earlier requests only
+        for window in windows:
+            start = np.searchsorted(timestamps, timestamps - window * STAMPS_PER_MS, side='left')
+            sums = {name: prefix_sum[end] - prefix_sum[start] for name, prefix_sum in prefix_sums.items()}
+            total_ops = sums['reads'] + sums['writes']
+            features = {
+                f'load_{window}ms_requests': sums['requests'],
+                f'load_{window}ms_bytes': sums['bytes'],
+                f'load_{window}ms_read_ratio': np.divide(sums['reads'], total_ops, out=np.zeros(len(total_ops)),
+                                                         where=total_ops > 0),
+            }
+            for name, values in features.items():
+                column = np.empty_like(values)
+                column[order] = values
+                entries[name] = column
+        return entries
+
+    # Bytes, read ops and write ops of every entries row.
+    def ops_per_entry(self):
+        op_codes = np.array([self.op_types[str(i)]['op_code'] for i in range(len(self.op_types))])
+        codes = op_codes[self.ops['type'].to_numpy()]
+        columns = {'bytes': self.ops['len'].to_numpy(), 'reads': (codes & RD) != 0, 'writes': (codes & WR) != 0}
+        if self.ops_index is not None:
+            # One bincount per column over the CSR op rows, no join on `index`.
+            rows = self.ops_index.rows()
+            per_entry = {name: np.bincount(rows, weights=values, minlength=len(self.entries))
+                         for name, values in columns.items()}
+        else:
+            per_entry = pd.DataFrame(dict(columns, index=self.ops['index'].to_numpy())).groupby('index').sum()
+            per_entry = per_entry.reindex(self.entries['index'], fill_value=0)
+            per_entry = {name: per_entry[name].to_numpy(dtype=np.float64) for name in columns}
+        per_entry['requests'] = np.ones(len(self.entries))
+        return per_entry
+
+    # Same aggregates as the groupby/unstack path, from one bincount over the CSR op rows: each entry row holds
+    # the op counts, summed len and summed offset of every io type side by side.
+    def aggregate_ops_csr(self, num_io_types):
+        num_entries = len(self.entries)
+        width = 3 * num_io_types
+        cells = self.ops_index.rows() * width + self.ops['type'].to_numpy()
+        values = np.bincount(np.concatenate([cells, cells + num_io_types, cells + 2 * num_io_types]),
+                             weights=np.concatenate([np.ones(len(cells)), self.ops['len'].to_numpy(),
+                                                     self.ops['off'].to_numpy()]),
+                             minlength=num_entries * width).reshape(num_entries, width)
+        counts, offsets = values[:, :num_io_types], values[:, 2 * num_io_types:]
+        np.divide(offsets, counts, out=offsets, where=counts > 0)
+        columns = ([f'io_type_{i}_num' for i in range(num_io_types)]
+                   + [f'sum_len_io_type_{i}' for i in range(num_io_types)]
+                   + [f'mean_offset_io_type_{i}' for i in range(num_io_types)])
+        return pd.DataFrame(values, columns=columns, index=self.entries.index, copy=False)
+
+    @profiled('IODataSet.preprocess')
     def preprocess(self):
         # mean = self.entries['latency'].mean()
         # print(mean)
-        self.apply_log_transform(self.entries, self.entry_log_transform_features)
-        self.apply_standard_scaling(self.entries, self.entry_standard_scale_features)
-        self.apply_minmax_scaling(self.entries, self.entry_minmax_scale_features)
-        self.apply_log_transform(self.ops, self.ops_log_transform_features)
-        self.apply_standard_scaling(self.ops, self.ops_standard_scale_features)
-        self.apply_minmax_scaling(self.ops, self.ops_minmax_scale_features)
-
-        all_io_types = list(range(len(self.op_types)))
-
-        # Count number of operations per io_type per index
-        io_counts = self.ops.groupby(['index', 'type']).size().unstack(fill_value=0)
-        io_counts = io_counts.reindex(columns=all_io_types, fill_value=0)  # Ensure all 81 columns exist
-        io_counts.columns = [f'io_type_{col}_num' for col in io_counts.columns]
-
-        # Aggregate sum of len and mean of offset per io_type per index
-        io_agg = self.ops.groupby(['index', 'type']).agg(
-            sum_len=('len', 'sum'),
-            mean_offset=('off', 'mean')
-        ).unstack(fill_value=0)
-
-        # Ensure all io_types are represented
-        extra_io_agg = io_agg.reindex(
-            columns=pd.MultiIndex.from_product([['sum_len', 'mean_offset'], all_io_types], names=['metric', 'io_type']),
-            fill_value=0)
-
-        # Flatten MultiIndex columns correctly
-        extra_io_agg.columns = [f'{col[0]}_io_type_{col[1]}' for col in extra_io_agg.columns]
-        extra_io_agg.reset_index(inplace=True)
-
-        all_entry_categories = list(range(len(self.entry_types)))  # Ensure all categories from 0 to 100 are included
-
-        # One-hot encode 'x'
-        onehot_encoder = OneHotEncoder(sparse_output=False, categories=[all_entry_categories], handle_unknown='ignore')
-        entry_type_encoded = onehot_encoder.fit_transform(self.entries[['type']])
-
-        # Convert to DataFrame
-        type_encoded_df = pd.DataFrame(entry_type_encoded, columns=[f'req_type_{i}' for i in all_entry_categories])
-
-        # Merge back with original df
-        self.entries = pd.concat([self.entries, type_encoded_df], axis=1)
-        self.entries.drop(columns=['type'], inplace=True)
-        self.entries.drop(columns=['data_len'], inplace=True)
-        self.entries.drop(columns=['data_off'], inplace=True)
-        self.entries.drop(columns=['dequeue_end_stamp'], inplace=True)
-        self.entries.drop(columns=['dequeue_stamp'], inplace=True)
-        self.entries.drop(columns=['enqueue_stamp'], inplace=True)
-        self.entries.drop(columns=['recv_stamp'], inplace=True)
-        self.entries.drop(columns=['owner'], inplace=True)
-
-        # Merge aggregated features with request dataset
-        self.data = self.entries.merge(io_counts, on='index', how='left').fillna(0)
-        self.data = self.data.merge(extra_io_agg, on='index', how='left').fillna(0)
-        self.data.drop(columns=['index'], inplace=True)
-        self.data.sort_values(by="timestamp", inplace=True)
-        self.data.drop(columns=['timestamp'], inplace=True)
-        train_end = int(len(self.data) * self.train_size)
-        val_end = train_end + int(len(self.data) * self.val_size)
-        if self.stage == 'train':
-            self.data = self.data.iloc[:train_end]
-        elif self.stage == 'val':
-            self.data = self.data.iloc[train_end:val_end]
+        if not self.arrival_features:
+            with stage('IODataSet.preprocess.queue_features'):
+                self.add_queue_features(self.entries)
+        with stage('IODataSet.preprocess.load_features'):
+            self.add_load_features(self.entries, self.ops_per_entry(), self.load_windows,
+                                   anchor='enqueue_stamp' if self.arrival_features else 'timestamp')
+
+        with stage('IODataSet.preprocess.normalize'):
+            self.apply_log_transform(self.entries, self.entry_log_transform_features)
+            self.apply_standard_scaling(self.entries, self.entry_standard_scale_features)
+            self.apply_minmax_scaling(self.entries, self.entry_minmax_scale_features)
+            self.apply_log_transform(self.ops, self.ops_log_transform_features)
+            self.apply_standard_scaling(self.ops, self.ops_standard_scale_features)
+            self.apply_minmax_scaling(self.ops, self.ops_minmax_scale_features)
+
+        with stage('IODataSet.preprocess.aggregate_ops'):
+            all_io_types = list(range(len(self.op_types)))
+            if self.ops_index is not None:
+                op_features = self.aggregate_ops_csr(len(all_io_types))
+            else:
+                # Count number of operations per io_type per index
+                io_counts = self.ops.groupby(['index', 'type']).size().unstack(fill_value=0)
+                io_counts = io_counts.reindex(columns=all_io_types, fill_value=0)  # Ensure all 81 columns exist
+                io_counts.columns = [f'io_type_{col}_num' for col in io_counts.columns]
+
+                # Aggregate sum of len and mean of offset per io_type per index
+                io_agg = self.ops.groupby(['index', 'type']).agg(
+                    sum_len=('len', 'sum'),
+                    mean_offset=('off', 'mean')
+                ).unstack(fill_value=0)
+
+                # Ensure all io_types are represented
+                extra_io_agg = io_agg.reindex(
+                    columns=pd.MultiIndex.from_product([['sum_len', 'mean_offset'], all_io_types], names=['metric', 'io_type']),
+                    fill_value=0)
+
+                # Flatten MultiIndex columns correctly
+                extra_io_agg.columns = [f'{col[0]}_io_type_{col[1]}' for col in extra_io_agg.columns]
+                extra_io_agg.reset_index(inplace=True)
+
+        with stage('IODataSet.preprocess.encode_types'):
+            if self.type_encoding == 'ordinal':
+                # A single integer column, for models with native categorical support
+                self.entries.rename(columns={'type': 'req_type'}, inplace=True)
+            else:
+                all_entry_categories = list(range(len(self.entry_types)))  # Ensure all categories from 0 to 100 are included
+
+                # One-hot encode 'x'
+                onehot_encoder = OneHotEncoder(sparse_output=False, categories=[all_entry_categories], handle_unknown='ignore')
+                entry_type_encoded = onehot_encoder.fit_transform(self.entries[['type']])
+
+                # Convert to DataFrame
+                type_encoded_df = pd.DataFrame(entry_type_encoded, columns=[f'req_type_{i}' for i in all_entry_categories])
+
+                # Merge back with original df
+                self.entries = pd.concat([self.entries, type_encoded_df], axis=1)
+                self.entries.drop(columns=['type'], inplace=True)
+            self.entries.drop(columns=['data_len'], inplace=True)
+            self.entries.drop(columns=['data_off'], inplace=True)
+            self.entries.drop(columns=['dequeue_end_stamp'], inplace=True)
+            self.entries.drop(columns=['dequeue_stamp'], inplace=True)
+            self.entries.drop(columns=['enqueue_stamp'], inplace=True)
+            self.entries.drop(columns=['recv_stamp'], inplace=True)
+            self.entries.drop(columns=['owner'], inplace=True)
+
+        with stage('IODataSet.preprocess.merge'):
+            # Merge aggregated features with request dataset
+            if self.ops_index is not None:
+                # Already aligned with the entries rows
+                self.data = pd.concat([self.entries, op_features], axis=1).fillna(0)
+            else:
+                self.data = self.entries.merge(io_counts, on='index', how='left').fillna(0)
+                self.data = self.data.merge(extra_io_agg, on='index', how='left').fillna(0)
+            self.data.drop(columns=['index'], inplace=True)
+            self.data.sort_values(by="timestamp", inplace=True)
+            self.data.drop(columns=['timestamp'], inplace=True)
+
+        if self.pruner is None and self.prune:
+            with stage('IODataSet.preprocess.prune'):
+                train_rows = self.stage_slice(len(self.data), 'train', self.train_size, self.val_size)
+                self.pruner = FeaturePruner().fit(self.data.iloc[train_rows].drop(columns=['latency', 'sample_weight'],
+                                                                                  errors='ignore'))
+        if self.pruner is not None:
+            self.data = self.pruner.transform(self.data, extra_columns=['latency', 'sample_weight'])
+        self.data = self.data.iloc[self.stage_slice(len(self.data), self.stage, self.train_size, self.val_size)]
+
+    @staticmethod
+    def stage_slice(length, stage, train_size, val_size):
+        train_end = int(length * train_size)
+        val_end = train_end + int(length * val_size)
+        if stage == 'train':
+            return slice(0, train_end)
+        elif stage == 'val':
+            return slice(train_end, val_end)
         else:
-            self.data = self.data.iloc[:val_end]
+            # Everything after the training and validation rows (after the training rows when val_size is 0).
+            return slice(val_end, length)
 
     def separate_labels(self):
         self.labels = self.data['latency']
         self.data.drop(columns=['latency'], inplace=True)
+        if 'sample_weight' in self.data.columns:
+            self.weights = self.data['sample_weight']
+            self.data.drop(columns=['sample_weight'], inplace=True)
 
+    @profiled('IODataSet.__getitem__')
     def __getitem__(self, idx):
         features = self.data.iloc[idx].to_numpy()
         label = self.labels.iloc[idx]
         features = features.astype(np.float32)
         label = label.astype(np.int64)
+        if self.return_weights:
+            return features, label, np.float32(self.weights.iloc[idx])
         return features, label
 
+    def as_arrays(self):
+        return self.data.to_numpy(dtype=np.float32), self.labels.to_numpy(dtype=np.int64)
+
 
 class IOBinClassificationDataSet(IODataSet):
-    def __init__(self, path, stage='train', val_size=0, train_size=0.8, shuffle=False, seed=12, threshold=2_000_000):
+    def __init__(self, path, stage='train', val_size=0, train_size=0.8, shuffle=False, seed=12, threshold=2_000_000,
+                 type_encoding='onehot', prune=False, schema=None):
         self.threshold = threshold
         super(IOBinClassificationDataSet, self).__init__(path, stage=stage, val_size=val_size, train_size=train_size,
-                                                         shuffle=shuffle, seed=seed, exclude_normalization=['latency'])
+                                                         shuffle=shuffle, seed=seed, exclude_normalization=['latency'],
+                                                         type_encoding=type_encoding, prune=prune, schema=schema)
 
     def preprocess(self):
         super().preprocess()
         self.data['latency'] = (self.data['latency'] >= self.threshold).astype(int)
+
+
+class IOLatencyDataSet(IODataSet):
+    # Regression targets: log1p of the raw latency.
+    def __init__(self, path, stage='train', val_size=0, train_size=0.8, shuffle=False, seed=12, prune=False,
+                 schema=None):
+        super(IOLatencyDataSet, self).__init__(path, stage=stage, val_size=val_size, train_size=train_size,
+                                               shuffle=shuffle, seed=seed, exclude_normalization=['latency'],
+                                               prune=prune, schema=schema)
+
+    def separate_labels(self):
+        super().separate_labels()
+        self.labels = np.log1p(self.labels)
+
+    def __getitem__(self, idx):
+        features = self.data.iloc[idx].to_numpy().astype(np.float32)
+        if self.return_weights:
+            return features, np.float32(self.labels.iloc[idx]), np.float32(self.weights.iloc[idx])
+        return features, np.float32(self.labels.iloc[idx])
+
+    def as_arrays(self):
+        return self.data.to_numpy(dtype=np.float32), self.labels.to_numpy(dtype=np.float32)
+
+
+class IOMultiOSDDataSet(IODataSet):
+    # Concatenation of several OSDs with an OSD identity input, either an `osd_id` index column (kept last so
+    # embedding models can split it off) or one-hot `osd_<i>` columns.
+    def __init__(self, paths, stage='train', val_size=0, train_size=0.8, thresholds=2_000_000, osd_encoding='index'):
+        if osd_encoding not in ['index', 'onehot']:
+            raise ArgumentError(f'Unknown osd encoding {osd_encoding}.')
+        if not isinstance(thresholds, (list, tuple)):
+            thresholds = [thresholds] * len(paths)
+        self.paths = paths
+        self.stage = stage
+        self.thresholds = thresholds
+        self.osd_encoding = osd_encoding
+        self.weights = None
+        self.return_weights = False
+        frames, labels, weights, osd_ids = [], [], [], []
+        for osd_id, (path, threshold) in enumerate(zip(paths, thresholds)):
+            dataset = IOBinClassificationDataSet(path, stage=stage, val_size=val_size, train_size=train_size,
+                                                 threshold=threshold)
+            frames.append(dataset.data)
+            labels.append(dataset.labels)
+            weights.append(dataset.weights)
+            osd_ids.append(np.full(len(dataset), osd_id, dtype=np.int64))
+        self.data = pd.concat(frames, ignore_index=True)
+        self.labels = pd.concat(labels, ignore_index=True)
+        if any(osd_weights is not None for osd_weights in weights):
+            # Down-sampled OSDs keep their sampling weights, OSDs with every request kept weigh 1.
+            self.weights = pd.concat([pd.Series(np.ones(len(frame))) if osd_weights is None else osd_weights
+                                      for frame, osd_weights in zip(frames, weights)], ignore_index=True)
+        self.osd_ids = np.concatenate(osd_ids)
+        if osd_encoding == 'index':
+            self.data['osd_id'] = self.osd_ids
+        else:
+            for osd_id in range(len(paths)):
+                self.data[f'osd_{osd_id}'] = (self.osd_ids == osd_id).astype(np.float32)
+
+    def num_osds(self):
+        return len(self.paths)
+
+
+class IOArrayDataSet(Dataset):
+    # Dataset over an already featurized matrix, e.g. one shared between several experiments.
+    def __init__(self, features, labels, label_dtype=np.int64, weights=None, columns=None):
+        self.data = features
+        self.labels = labels
+        self.label_dtype = label_dtype
+        self.weights = weights
+        # Feature names (columns.json of the cache), for models that treat some columns specially.
+        self.columns = columns
+        self.return_weights = False
+
+    def __len__(self):
+        return len(self.data)
+
+    def input_size(self):
+        return self.data.shape[1]
+
+    def __getitem__(self, idx):
+        if self.return_weights:
+            return (np.array(self.data[idx], dtype=np.float32), self.label_dtype(self.labels[idx]),
+                    np.float32(self.weights[idx]))
+        return np.array(self.data[idx], dtype=np.float32), self.label_dtype(self.labels[idx])
+
+    def as_arrays(self):
+        return np.asarray(self.data, dtype=np.float32), np.asarray(self.labels, dtype=self.label_dtype)
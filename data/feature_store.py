@@ -0,0 +1,159 @@
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from data.featurized import COLUMNS_FILE, FEATURES_FILE, LATENCY_FILE, WEIGHTS_FILE, load_featurized, load_weights
+from data.pruning import SCHEMA_FILE
+
+# Host-local store of featurized OSDs in shared memory (tmpfs). An OSD is published once and every process on the
+# host maps the same pages read-only, so concurrent trainings do not each hold a copy of the matrix. Attached
+# processes are recorded per pid in a reference file; the entry is deleted when the last one releases it, and
+# processes that died without releasing are dropped whenever the references are updated.
+
+STORE_ROOT = '/dev/shm/deepqos' if os.path.isdir('/dev/shm') else os.path.join(tempfile.gettempdir(), 'deepqos')
+REFS_FILE = 'refs.json'
+SOURCE_FILE = 'source.json'
+STORE_FILES = [FEATURES_FILE, LATENCY_FILE, COLUMNS_FILE, WEIGHTS_FILE, SCHEMA_FILE]
+
+
+def source_signature(featurized_path):
+    # Size and modification time of every file of the featurized cache: a regenerated cache gets a new signature.
+    signature = {}
+    for name in STORE_FILES:
+        path = os.path.join(featurized_path, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature[name] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class FeatureStore:
+    def __init__(self, name, root=STORE_ROOT):
+        self.name = name
+        self.root = root
+        self.path = os.path.join(root, name)
+        self.attached = False
+
+    @contextmanager
+    def locked(self):
+        # The lock lives next to the entry so it survives the entry being deleted. It is removed, while held, once
+        # the entry is gone; a process that was waiting on the removed file then locks a new one instead.
+        if not os.path.exists(self.root):
+            os.makedirs(self.root, exist_ok=True)
+        lock_path = os.path.join(self.root, f'.{self.name}.lock')
+        while True:
+            lock = open(lock_path, 'a')
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.fstat(lock.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            lock.close()
+        try:
+            yield
+        finally:
+            if not self.published():
+                os.unlink(lock_path)
+            lock.close()
+
+    def read_refs(self):
+        try:
+            with open(os.path.join(self.path, REFS_FILE), 'r') as file:
+                refs = {int(pid): count for pid, count in json.load(file).items()}
+        except FileNotFoundError:
+            return {}
+        return {pid: count for pid, count in refs.items() if pid_alive(pid)}
+
+    def write_refs(self, refs):
+        if not refs:
+            shutil.rmtree(self.path, ignore_errors=True)
+            return
+        with open(os.path.join(self.path, REFS_FILE), 'w') as file:
+            json.dump(refs, file)
+
+    def update_refs(self, delta):
+        refs = self.read_refs()
+        pid = os.getpid()
+        refs[pid] = refs.get(pid, 0) + delta
+        if refs[pid] <= 0:
+            del refs[pid]
+        self.write_refs(refs)
+        return refs
+
+    def published(self):
+        return os.path.exists(os.path.join(self.path, REFS_FILE))
+
+    def read_source(self):
+        try:
+            with open(os.path.join(self.path, SOURCE_FILE), 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def publish(self, featurized_path):
+        # Copies a featurized cache into shared memory and attaches to it. An existing entry is reused only while
+        # some live process holds it and it was copied from the same version of the cache; otherwise (left over by
+        # crashed processes, or the cache was regenerated) it is copied again. Processes still attached to a
+        # replaced copy keep their mappings and their references.
+        signature = source_signature(featurized_path)
+        with self.locked():
+            refs = self.read_refs()
+            if not refs or self.read_source() != signature:
+                staging = tempfile.mkdtemp(prefix=f'.{self.name}.', dir=self.root)
+                for name in signature:
+                    shutil.copyfile(os.path.join(featurized_path, name), os.path.join(staging, name))
+                with open(os.path.join(staging, SOURCE_FILE), 'w') as file:
+                    json.dump(signature, file)
+                shutil.rmtree(self.path, ignore_errors=True)
+                os.rename(staging, self.path)
+                if refs:
+                    self.write_refs(refs)
+            self.update_refs(1)
+        self.attached = True
+        return self
+
+    def attach(self):
+        with self.locked():
+            if not self.read_refs():
+                # Nothing published, or only left over by processes that died
+                raise FileNotFoundError(f'Nothing published as {self.name} in {self.root}.')
+            self.update_refs(1)
+        self.attached = True
+        return self.arrays()
+
+    def arrays(self):
+        # Zero-copy: read-only memory maps of the shared files.
+        features, latency, columns = load_featurized(self.path)
+        return features, latency, columns, load_weights(self.path)
+
+    def release(self):
+        if not self.attached:
+            return
+        with self.locked():
+            self.update_refs(-1)
+        self.attached = False
+
+    def refs(self):
+        with self.locked():
+            return sum(self.read_refs().values())
+
+    def __enter__(self):
+        self.attach()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,77 @@
+import json
+import os
+
+import numpy as np
+
+from data.dataset import IODataSet, IOArrayDataSet
+from data.pruning import FeaturePruner, SCHEMA_FILE
+
+FEATURES_FILE = 'features.npy'
+LATENCY_FILE = 'latency.npy'
+COLUMNS_FILE = 'columns.json'
+WEIGHTS_FILE = 'weights.npy'
+
+
+def featurize_frame(path, prune=False, prune_fit_size=0.7, arrival_features=False):
+    # Latency is kept raw so that every threshold can be derived from the same matrix.
+    dataset = IODataSet(path, stage='train', train_size=1.0, exclude_normalization=['latency'],
+                        arrival_features=arrival_features)
+    data, pruner = dataset.data, None
+    if prune:
+        pruner = FeaturePruner().fit(data.iloc[:int(len(data) * prune_fit_size)])
+        data = pruner.transform(data)
+    return data, dataset.labels, pruner, dataset.weights
+
+
+def featurize_arrays(path, prune=False, prune_fit_size=0.7):
+    data, labels, _, _ = featurize_frame(path, prune=prune, prune_fit_size=prune_fit_size)
+    return data.to_numpy(dtype=np.float32), labels.to_numpy(dtype=np.int64), list(data.columns)
+
+
+def featurize_osd(path, output_path, prune=False, prune_fit_size=0.7, arrival_features=False):
+    data, labels, pruner, weights = featurize_frame(path, prune=prune, prune_fit_size=prune_fit_size,
+                                                    arrival_features=arrival_features)
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    if pruner is not None:
+        pruner.save(os.path.join(output_path, SCHEMA_FILE))
+    np.save(os.path.join(output_path, FEATURES_FILE), data.to_numpy(dtype=np.float32))
+    np.save(os.path.join(output_path, LATENCY_FILE), labels.to_numpy(dtype=np.int64))
+    if weights is not None:
+        np.save(os.path.join(output_path, WEIGHTS_FILE), weights.to_numpy(dtype=np.float32))
+    with open(os.path.join(output_path, COLUMNS_FILE), 'w') as file:
+        json.dump(list(data.columns), file)
+    return output_path
+
+
+def is_featurized(path):
+    return all(os.path.exists(os.path.join(path, name)) for name in [FEATURES_FILE, LATENCY_FILE, COLUMNS_FILE])
+
+
+def load_featurized(path, mmap=True):
+    # Memory mapped arrays share the page cache between every process reading the same OSD.
+    mmap_mode = 'r' if mmap else None
+    features = np.load(os.path.join(path, FEATURES_FILE), mmap_mode=mmap_mode)
+    latency = np.load(os.path.join(path, LATENCY_FILE), mmap_mode=mmap_mode)
+    with open(os.path.join(path, COLUMNS_FILE), 'r') as file:
+        columns = json.load(file)
+    return features, latency, columns
+
+
+def load_weights(path, mmap=True):
+    # Sampling weights of a down-sampled trace, None when every request was kept.
+    weights_path = os.path.join(path, WEIGHTS_FILE)
+    if not os.path.exists(weights_path):
+        return None
+    return np.load(weights_path, mmap_mode='r' if mmap else None)
+
+
+def bin_classification_datasets(features, latency, threshold, train_size=0.7, val_size=0.15,
+                                stages=('train', 'val', 'test'), weights=None, columns=None):
+    labels = (np.asarray(latency) >= threshold).astype(np.int64)
+    datasets = []
+    for stage in stages:
+        stage_slice = IODataSet.stage_slice(len(features), stage, train_size, val_size)
+        datasets.append(IOArrayDataSet(features[stage_slice], labels[stage_slice],
+                                       weights=None if weights is None else weights[stage_slice], columns=columns))
+    return tuple(datasets)
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Ops grouped by request in CSR layout: ops are sorted by the row of their entry in entries.csv and the ops of row i
+# are offsets[i]:offsets[i + 1] of every column, so a request's ops are a slice and per-request aggregates need no
+# join on `index`.
+
+OPS_INDEX_DIR = 'ops_csr'
+OPS_COLUMNS = ['type', 'len', 'off']
+
+
+class OpsIndex:
+    def __init__(self, offsets, columns):
+        self.offsets = offsets
+        self.columns = columns
+
+    @staticmethod
+    def from_frames(entries, ops):
+        keys, op_keys = entries['index'].to_numpy(), ops['index'].to_numpy()
+        if len(keys) and entries['index'].is_monotonic_increasing:
+            # Entries sorted by request key: binary search instead of hashing.
+            rows = np.minimum(np.searchsorted(keys, op_keys), len(keys) - 1)
+            rows[keys[rows] != op_keys] = -1
+        else:
+            rows = pd.Index(keys).get_indexer(op_keys)
+        matched = rows >= 0
+        rows = rows[matched]
+        order = np.argsort(rows, kind='stable')
+        counts = np.bincount(rows, minlength=len(entries))
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        columns = {name: ops[name].to_numpy()[matched][order] for name in OPS_COLUMNS}
+        return OpsIndex(offsets, columns)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return {name: values[start:end] for name, values in self.columns.items()}
+
+    def counts(self):
+        return np.diff(self.offsets)
+
+    def rows(self):
+        # Entry row of every op.
+        return np.repeat(np.arange(len(self)), self.counts())
+
+    def frame(self, keys):
+        # Ops frame in the layout of ops.csv, `keys` being the entries' `index` column.
+        return pd.DataFrame(dict({'index': np.repeat(np.asarray(keys), self.counts())}, **self.columns))
+
+    def save(self, path):
+        index_path = os.path.join(path, OPS_INDEX_DIR)
+        if not os.path.exists(index_path):
+            os.makedirs(index_path)
+        np.save(os.path.join(index_path, 'offsets.npy'), self.offsets)
+        for name, values in self.columns.items():
+            np.save(os.path.join(index_path, f'{name}.npy'), values)
+
+    @staticmethod
+    def load(path, mmap=True):
+        index_path = os.path.join(path, OPS_INDEX_DIR)
+        mmap_mode = 'r' if mmap else None
+        offsets = np.load(os.path.join(index_path, 'offsets.npy'), mmap_mode=mmap_mode)
+        columns = {name: np.load(os.path.join(index_path, f'{name}.npy'), mmap_mode=mmap_mode)
+                   for name in OPS_COLUMNS}
+        return OpsIndex(offsets, columns)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, OPS_INDEX_DIR, 'offsets.npy'))
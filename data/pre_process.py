@@ -1,10 +1,16 @@
 import argparse
 import json
 import os
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import re
 
+from data.ops_index import OpsIndex
+from data.query_index import build_query_index
+from data.snapshots import ARCHIVE_FILE, SnapshotArchive
+from utils.profiler import PROFILER, profiled, stage
+
 CPU_HEADERS = [
     'user',  # Time spent in user mode
     'nice',  # Time spent in user mode with nice priority
@@ -62,6 +68,12 @@ RMW = 0x3000
 SUB = 0x4000
 CACHE = 0x8000
 
+# Request keys: experiment id, OSD id and the per-run request index packed into one int64, so that keys of
+# concatenated runs never collide and sort by (experiment, OSD, index).
+KEY_EXPERIMENT_BITS = 15
+KEY_OSD_BITS = 8
+KEY_INDEX_BITS = 40
+
 DATA = 0x0200
 ATTR = 0x0300
 EXEC = 0x0400
@@ -468,53 +480,77 @@ for code, (op_type, idx) in MSG_OSD_OPS.items():
     IDX_TO_MSG_OSD_OPS[idx] = {'op_code': code, 'type': op_type}
 
 
-def read_cpu_info(path):
-    cpu_info = {}
+def read_text(path):
     try:
         with open(path, 'r') as file:
-            lines = file.readlines()
-            total_cpu_line = lines[0].split()
-            cpu_count = len(list(filter(lambda line: re.match(r'^cpu\d+.*', line), lines)))
-            for header, val in zip(CPU_HEADERS, total_cpu_line[1:]):
-                cpu_info[header] = int(val)
-            cpu_info['cpu_count'] = cpu_count
+            return file.read()
     except Exception as ex:
         print(f"Error reading {path}: {ex}")
+        return None
+
+
+def parse_cpu_info(text, source):
+    cpu_info = {}
+    if text is None:
+        return cpu_info
+    try:
+        lines = text.splitlines()
+        total_cpu_line = lines[0].split()
+        cpu_count = len(list(filter(lambda line: re.match(r'^cpu\d+.*', line), lines)))
+        for header, val in zip(CPU_HEADERS, total_cpu_line[1:]):
+            cpu_info[header] = int(val)
+        cpu_info['cpu_count'] = cpu_count
+    except Exception as ex:
+        print(f"Error reading {source}: {ex}")
     return cpu_info
 
 
-def read_mem_info(path):
+def parse_mem_info(text, source):
     mem_info = {}
+    if text is None:
+        return mem_info
     try:
-        with open(path, 'r') as f:
-            for line in f:
-                parts = line.split(':')
-                if len(parts) == 2:
-                    key = parts[0].strip()
-                    if key not in MEM_HEADERS:
-                        continue
-                    value = parts[1].strip().split()[0]
-                    mem_info[key] = int(value)
+        for line in text.splitlines():
+            parts = line.split(':')
+            if len(parts) == 2:
+                key = parts[0].strip()
+                if key not in MEM_HEADERS:
+                    continue
+                value = parts[1].strip().split()[0]
+                mem_info[key] = int(value)
     except Exception as ex:
-        print(f"Error reading {path}: {ex}")
+        print(f"Error reading {source}: {ex}")
     return mem_info
 
 
-def read_disk_info(path, disk_labels):
+def parse_disk_info(text, source, disk_labels):
     disk_info = {}
+    if text is None:
+        return disk_info
     try:
-        with open(path, 'r') as f:
-            for line in f:
-                parts = line.strip().split()[2:]
-                if len(parts) >= len(DISK_HEADER) and parts[0] in disk_labels:
-                    parts = parts[:len(DISK_HEADER)]
-                    data = {DISK_HEADER[i]: int(parts[i]) if i > 2 else parts[i] for i in range(len(parts))}
-                    disk_info[disk_labels[data['device_name']]] = data
+        for line in text.splitlines():
+            parts = line.strip().split()[2:]
+            if len(parts) >= len(DISK_HEADER) and parts[0] in disk_labels:
+                parts = parts[:len(DISK_HEADER)]
+                data = {DISK_HEADER[i]: int(parts[i]) if i > 2 else parts[i] for i in range(len(parts))}
+                disk_info[disk_labels[data['device_name']]] = data
     except Exception as ex:
-        print(f"Error reading {path}: {ex}")
+        print(f"Error reading {source}: {ex}")
     return disk_info
 
 
+def read_cpu_info(path):
+    return parse_cpu_info(read_text(path), path)
+
+
+def read_mem_info(path):
+    return parse_mem_info(read_text(path), path)
+
+
+def read_disk_info(path, disk_labels):
+    return parse_disk_info(read_text(path), path, disk_labels)
+
+
 def read_system_state(path, disk_labels):
     cpu_path = os.path.join(path, 'cpu.txt')
     mem_path = os.path.join(path, 'mem.txt')
@@ -522,6 +558,29 @@ def read_system_state(path, disk_labels):
     return read_cpu_info(cpu_path), read_mem_info(mem_path), read_disk_info(disk_path, disk_labels)
 
 
+def system_state_row(time, cpu_info, mem_info, disk_info):
+    system_state = {'timestamp': time}
+    for field, val in cpu_info.items():
+        system_state[f'cpu_{field}'] = val
+    for field, val in mem_info.items():
+        system_state[f'mem_{field}'] = val
+    for partition, partition_data in disk_info.items():
+        partition = partition.replace('-', '_')
+        for field, val in partition_data.items():
+            system_state[f'disk_{partition}_{field}'] = val
+    return system_state
+
+
+def read_archived_system_states(archive_path, disk_labels):
+    system_states = []
+    for time, (cpu_text, mem_text, disk_text) in SnapshotArchive(archive_path):
+        source = f'{archive_path}@{time}'
+        system_states.append(system_state_row(time, parse_cpu_info(cpu_text, source),
+                                              parse_mem_info(mem_text, source),
+                                              parse_disk_info(disk_text, source, disk_labels)))
+    return system_states
+
+
 def read_disk_labels(path):
     disk_labels = {}
     with open(path, 'r') as file:
@@ -535,9 +594,13 @@ def read_disk_labels(path):
     return disk_labels
 
 
+@profiled('pre_process.read_osd_data')
 def read_osd_data(osd_data_path):
     disk_labels = read_disk_labels(os.path.join(osd_data_path, 'disks_labels.txt'))
-    system_states = []
+    # Packed OSDs keep their snapshots in a single archive instead of one folder per snapshot.
+    archive_path = os.path.join(osd_data_path, ARCHIVE_FILE)
+    packed = os.path.exists(archive_path)
+    system_states = read_archived_system_states(archive_path, disk_labels) if packed else []
     entries = None
     ops = None
     for item in Path(osd_data_path).iterdir():
@@ -545,19 +608,10 @@ def read_osd_data(osd_data_path):
             entries = pd.read_csv(item)
         if item.is_file() and re.match(r'^ops_.*\.csv$', item.name):
             ops = pd.read_csv(item)
-        if item.is_dir() and re.match(r'^\d+$', item.name):
+        if not packed and item.is_dir() and re.match(r'^\d+$', item.name):
             time = int(item.name)
-            system_state = {'timestamp': time}
             cpu_info, mem_info, disk_info = read_system_state(item, disk_labels)
-            for field, val in cpu_info.items():
-                system_state[f'cpu_{field}'] = val
-            for field, val in mem_info.items():
-                system_state[f'mem_{field}'] = val
-            for partition, partition_data in disk_info.items():
-                partition = partition.replace('-', '_')
-                for field, val in partition_data.items():
-                    system_state[f'disk_{partition}_{field}'] = val
-            system_states.append(system_state)
+            system_states.append(system_state_row(time, cpu_info, mem_info, disk_info))
     return entries, ops, pd.DataFrame(system_states)
 
 
@@ -586,12 +640,16 @@ def store_exp_data(exp_data, output_path):
                 data.to_csv(path, index=False)
             else:
                 print(f'Unknown data type for {name}: {type(data)}. We expect pandas.DataFrame.')
+        if 'entries' in osd_data and 'ops' in osd_data:
+            OpsIndex.from_frames(osd_data['entries'], osd_data['ops']).save(osd_output_path)
         idx_to_osd_op_path = os.path.join(osd_output_path, 'osd_op_types.json')
         with open(idx_to_osd_op_path, "w") as file:
             json.dump(IDX_TO_OSD_OPS, file)
         idx_to_msg_op_path = os.path.join(osd_output_path, 'msg_op_types.json')
         with open(idx_to_msg_op_path, "w") as file:
             json.dump(IDX_TO_MSG_OSD_OPS, file)
+        if 'entries' in osd_data:
+            build_query_index(osd_output_path)
 
 
 def preprocess_system_states(data_dict: dict):
@@ -606,36 +664,123 @@ def preprocess_entries(data_dict: dict):
         entries_df['type'] = entries_df['type'].map(lambda x: MSG_OSD_OPS[x][1])
         entries_df['timestamp'] = entries_df['dequeue_stamp']
         entries_df['latency'] = entries_df['dequeue_end_stamp'] - entries_df['dequeue_stamp']
-        entries_df.sort_values(by=['timestamp'], inplace=True)
+        # Both tables are kept sorted by request key (models re-sort the entries by timestamp).
+        entries_df.sort_values(by=['index'], kind='stable', inplace=True)
         ops_df = osd_data['ops']
         ops_df['type'] = ops_df['type'].map(lambda x: OSD_OPS[x][2])
-
-
-def read_all(path):
+        ops_df.sort_values(by=['index'], kind='stable', inplace=True)
+
+
+def pack_keys(experiment, osd_id, index):
+    index = np.asarray(index, dtype=np.int64)
+    if not 0 <= experiment < 1 << KEY_EXPERIMENT_BITS or not 0 <= osd_id < 1 << KEY_OSD_BITS:
+        raise ValueError(f'Experiment {experiment} or OSD {osd_id} does not fit in a request key.')
+    if len(index) and (index.min() < 0 or index.max() >= 1 << KEY_INDEX_BITS):
+        raise ValueError(f'Request indexes of experiment {experiment}, OSD {osd_id} do not fit in a request key.')
+    return (np.int64(experiment) << (KEY_OSD_BITS + KEY_INDEX_BITS)) | (np.int64(osd_id) << KEY_INDEX_BITS) | index
+
+
+def unpack_keys(keys):
+    keys = np.asarray(keys, dtype=np.int64)
+    return (keys >> (KEY_OSD_BITS + KEY_INDEX_BITS), (keys >> KEY_INDEX_BITS) & ((1 << KEY_OSD_BITS) - 1),
+            keys & ((1 << KEY_INDEX_BITS) - 1))
+
+
+def assign_keys(osd_data, experiment, osd_id):
+    # Replaces the per-run `index` of entries and ops by the packed request key and sorts both tables by it.
+    for name in ['entries', 'ops']:
+        frame = osd_data[name]
+        frame['index'] = pack_keys(experiment, osd_id, frame['index'])
+        frame.sort_values(by=['index'], kind='stable', inplace=True)
+
+
+class EntrySampler:
+    # Class-aware reservoir sampling of entries during ingestion. Entries are stratified by request type (and by
+    # slow/fast when a latency threshold is given); each stratum keeps at most `capacity` entries, chosen as the
+    # smallest random keys seen so far, which is a uniform reservoir that can be merged across experiments. Kept
+    # entries get `sample_weight` = entries seen / entries kept in their stratum, so weighted training matches
+    # the full trace.
+    def __init__(self, capacity, threshold=None, seed=42):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.rng = np.random.default_rng(seed)
+        self.seen = {}
+        self.kept = {}
+        self.ops = {}
+
+    def strata(self, entries):
+        strata = entries['type'].astype(np.int64)
+        if self.threshold is not None:
+            slow = (entries['dequeue_end_stamp'] - entries['dequeue_stamp']) >= self.threshold
+            strata = strata * 2 + slow.astype(np.int64)
+        return strata
+
+    def add(self, osd_name, experiment, entries, ops):
+        entries = entries.assign(_stratum=self.strata(entries), _key=self.rng.random(len(entries)),
+                                 _experiment=experiment)
+        seen = entries['_stratum'].value_counts()
+        if osd_name in self.seen:
+            seen = self.seen[osd_name].add(seen, fill_value=0)
+        self.seen[osd_name] = seen
+        if osd_name in self.kept:
+            entries = pd.concat([self.kept[osd_name], entries], ignore_index=True)
+        kept = entries.sort_values(by=['_key']).groupby('_stratum', sort=False).head(self.capacity)
+        self.kept[osd_name] = kept
+
+        # Only keep the ops of kept entries, so memory stays bounded by the reservoir size.
+        osd_ops = self.ops.setdefault(osd_name, {})
+        osd_ops[experiment] = ops
+        for exp, exp_ops in osd_ops.items():
+            kept_index = kept.loc[kept['_experiment'] == exp, 'index']
+            osd_ops[exp] = exp_ops[exp_ops['index'].isin(kept_index)]
+
+    def result(self, osd_name):
+        kept = self.kept[osd_name]
+        weights = self.seen[osd_name] / kept['_stratum'].value_counts()
+        entries = kept.assign(sample_weight=kept['_stratum'].map(weights))
+        entries = entries.drop(columns=['_stratum', '_key', '_experiment'])
+        return entries, pd.concat(list(self.ops[osd_name].values()))
+
+
+def read_all(path, sampler=None):
     data = {}
-    for item in Path(path).iterdir():
+    for experiment, item in enumerate(sorted(Path(path).iterdir())):
         data_dict = read_experiment_data(item)
         for osd_name in data_dict.keys():
+            assign_keys(data_dict[osd_name], experiment, int(osd_name[len('osd'):]))
             if osd_name not in data:
                 data[osd_name] = {}
             for data_name in data_dict[osd_name].keys():
+                if sampler is not None and data_name in ['entries', 'ops']:
+                    continue
                 if data_name not in data[osd_name]:
                     data[osd_name][data_name] = []
                 data[osd_name][data_name].append(data_dict[osd_name][data_name])
+            if sampler is not None:
+                sampler.add(osd_name, experiment, data_dict[osd_name]['entries'], data_dict[osd_name]['ops'])
     for osd_name in data.keys():
         for data_name in data[osd_name].keys():
             data[osd_name][data_name] = pd.concat(data[osd_name][data_name])
+        if sampler is not None:
+            data[osd_name]['entries'], data[osd_name]['ops'] = sampler.result(osd_name)
     return data
 
 
 def main(args):
-    data_dict = read_all(args.input)
-    preprocess_system_states(data_dict)
-    preprocess_entries(data_dict)
-    store_exp_data(data_dict, args.output)
-
-
-if __name__ == '__main__':
+    sampler = None
+    if args.sample_capacity is not None:
+        sampler = EntrySampler(args.sample_capacity, threshold=args.sample_threshold, seed=args.seed)
+    with stage('pre_process.read_all'):
+        data_dict = read_all(args.input, sampler=sampler)
+    with stage('pre_process.preprocess_system_states'):
+        preprocess_system_states(data_dict)
+    with stage('pre_process.preprocess_entries'):
+        preprocess_entries(data_dict)
+    with stage('pre_process.store_exp_data'):
+        store_exp_data(data_dict, args.output)
+
+
+def cli(argv=None):
     parser = argparse.ArgumentParser(description='data pre-processing')
     parser.add_argument('-i', '--input', metavar='input',
                         required=True, dest='input',
@@ -643,4 +788,25 @@ if __name__ == '__main__':
     parser.add_argument('-o', '--output', metavar='output',
                         required=True, dest='output',
                         help='Output folder.')
-    main(parser.parse_args())
+    parser.add_argument('--sample-capacity', metavar='capacity', type=int,
+                        default=None, dest='sample_capacity',
+                        help='Keep at most this many entries per request type (and class) per OSD.')
+    parser.add_argument('--sample-threshold', metavar='threshold', type=int,
+                        default=None, dest='sample_threshold',
+                        help='Latency threshold used to also stratify sampling by slow/fast.')
+    parser.add_argument('--seed', metavar='seed', type=int,
+                        default=42, dest='seed',
+                        help='Sampling seed.')
+    parser.add_argument('--profile', metavar='profile',
+                        default=None, dest='profile',
+                        help='Write stage timings (json) and a Chrome trace to this folder.')
+    args = parser.parse_args(argv)
+    if args.profile is not None:
+        PROFILER.enable()
+    main(args)
+    if args.profile is not None:
+        PROFILER.write(args.profile)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,67 @@
+import json
+
+import numpy as np
+
+SCHEMA_FILE = 'feature_schema.json'
+
+
+class FeaturePruner:
+    # Drops zero-variance columns and columns (almost) perfectly correlated with an earlier kept column, based on
+    # the training rows only. The kept schema is saved so evaluation and inference select the same columns.
+    def __init__(self, variance_threshold=0.0, correlation_threshold=0.999, max_rows=200_000, seed=42):
+        self.variance_threshold = variance_threshold
+        self.correlation_threshold = correlation_threshold
+        self.max_rows = max_rows
+        self.seed = seed
+        self.columns = None
+        self.dropped = {}
+
+    def fit(self, data):
+        columns = list(data.columns)
+        values = data.to_numpy(dtype=np.float64)
+        variances = values.var(axis=0)
+        self.dropped = {column: 'constant' for column, variance in zip(columns, variances)
+                        if variance <= self.variance_threshold}
+        candidates = [i for i, column in enumerate(columns) if column not in self.dropped]
+
+        # Correlations only need a sample of rows; the variance check above used all of them.
+        if len(values) > self.max_rows:
+            rows = np.random.default_rng(self.seed).choice(len(values), self.max_rows, replace=False)
+            values = values[np.sort(rows)]
+        sample = values[:, candidates]
+        std = sample.std(axis=0)
+        std[std == 0] = 1
+        standardized = (sample - sample.mean(axis=0)) / std
+        correlation = np.abs(standardized.T @ standardized) / len(standardized)
+
+        kept = []
+        for position, column_idx in enumerate(candidates):
+            duplicates = [k for k in kept if correlation[position, k] >= self.correlation_threshold]
+            if duplicates:
+                self.dropped[columns[column_idx]] = f'duplicate of {columns[candidates[duplicates[0]]]}'
+            else:
+                kept.append(position)
+        self.columns = [columns[candidates[position]] for position in kept]
+        return self
+
+    def transform(self, data, extra_columns=()):
+        return data[self.columns + [column for column in extra_columns if column in data.columns]]
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump({
+                'columns': self.columns,
+                'dropped': self.dropped,
+                'variance_threshold': self.variance_threshold,
+                'correlation_threshold': self.correlation_threshold,
+            }, file, indent=2)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'r') as file:
+            schema = json.load(file)
+        pruner = FeaturePruner(variance_threshold=schema['variance_threshold'],
+                               correlation_threshold=schema['correlation_threshold'])
+        pruner.columns = schema['columns']
+        pruner.dropped = schema['dropped']
+        return pruner
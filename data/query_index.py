@@ -0,0 +1,147 @@
+import argparse
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from data.ops_index import OpsIndex
+
+# Sparse index over a pre-processed OSD folder: entries.csv is cut into blocks of `block_size` rows and, for every
+# block, the index keeps its byte range in the file, its min/max timestamp and a bitmap of the request types it
+# contains. A query only parses the blocks that can match; the ops of the matching requests are sliced from the CSR
+# ops index when it is there.
+
+QUERY_INDEX_FILE = 'entries_index.npz'
+
+
+def build_query_index(osd_path, block_size=8192):
+    entries_path = os.path.join(osd_path, 'entries.csv')
+    with open(entries_path, 'rb') as file:
+        header = file.readline()
+        line_offsets = [len(header)]
+        for line in file:
+            line_offsets.append(line_offsets[-1] + len(line))
+    rows = len(line_offsets) - 1
+    byte_offsets = np.array(line_offsets[::block_size] + ([line_offsets[-1]] if rows % block_size else []),
+                            dtype=np.int64)
+    entries = pd.read_csv(entries_path, usecols=['timestamp', 'type'])
+    with open(os.path.join(osd_path, 'msg_op_types.json'), 'r') as file:
+        num_types = len(json.load(file))
+    starts = np.arange(0, rows, block_size)
+    timestamps = entries['timestamp'].to_numpy()
+    types = np.zeros((len(starts), num_types), dtype=bool)
+    types[np.arange(rows) // block_size, entries['type'].to_numpy()] = True
+    np.savez(os.path.join(osd_path, QUERY_INDEX_FILE), block_size=block_size, byte_offsets=byte_offsets,
+             min_timestamps=np.minimum.reduceat(timestamps, starts) if rows else np.empty(0, dtype=np.int64),
+             max_timestamps=np.maximum.reduceat(timestamps, starts) if rows else np.empty(0, dtype=np.int64),
+             type_bitmaps=np.packbits(types, axis=1), num_types=num_types,
+             columns=np.array(header.decode().strip().split(',')))
+
+
+class OSDQuery:
+    def __init__(self, osd_path):
+        self.path = osd_path
+        index_path = os.path.join(osd_path, QUERY_INDEX_FILE)
+        if not os.path.exists(index_path):
+            build_query_index(osd_path)
+        with np.load(index_path) as index:
+            self.block_size = int(index['block_size'])
+            self.byte_offsets = index['byte_offsets']
+            self.min_timestamps = index['min_timestamps']
+            self.max_timestamps = index['max_timestamps']
+            self.type_bitmaps = index['type_bitmaps']
+            self.num_types = int(index['num_types'])
+            self.columns = list(index['columns'])
+        with open(os.path.join(osd_path, 'msg_op_types.json'), 'r') as file:
+            self.type_names = {info['type']: int(idx) for idx, info in json.load(file).items()}
+        self.ops_index = OpsIndex.load(osd_path) if OpsIndex.exists(osd_path) else None
+
+    def type_ids(self, types):
+        return [self.type_names[t] if isinstance(t, str) else int(t) for t in types]
+
+    def blocks(self, start=None, end=None, types=None):
+        candidates = np.ones(len(self.min_timestamps), dtype=bool)
+        if start is not None:
+            candidates &= self.max_timestamps >= start
+        if end is not None:
+            candidates &= self.min_timestamps < end
+        if types is not None:
+            bitmaps = np.unpackbits(self.type_bitmaps, axis=1, count=self.num_types)
+            candidates &= bitmaps[:, self.type_ids(types)].any(axis=1)
+        return np.flatnonzero(candidates)
+
+    def read_blocks(self, blocks):
+        frames = []
+        with open(os.path.join(self.path, 'entries.csv'), 'rb') as file:
+            # Consecutive blocks are read in one go.
+            runs = np.split(blocks, np.flatnonzero(np.diff(blocks) > 1) + 1) if len(blocks) else []
+            for run in runs:
+                file.seek(self.byte_offsets[run[0]])
+                data = file.read(self.byte_offsets[run[-1] + 1] - self.byte_offsets[run[0]])
+                frame = pd.read_csv(io.BytesIO(data), header=None, names=self.columns)
+                frame.index = np.arange(run[0] * self.block_size, run[0] * self.block_size + len(frame))
+                frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=self.columns)
+        return pd.concat(frames)
+
+    def entries(self, start=None, end=None, types=None):
+        # Requests with start <= timestamp < end; the frame index is the row in entries.csv.
+        entries = self.read_blocks(self.blocks(start, end, types))
+        mask = np.ones(len(entries), dtype=bool)
+        if start is not None:
+            mask &= entries['timestamp'].to_numpy() >= start
+        if end is not None:
+            mask &= entries['timestamp'].to_numpy() < end
+        if types is not None:
+            mask &= entries['type'].isin(self.type_ids(types)).to_numpy()
+        return entries[mask]
+
+    def ops(self, entries):
+        if self.ops_index is None:
+            ops = pd.read_csv(os.path.join(self.path, 'ops.csv'))
+            return ops[ops['index'].isin(entries['index'])]
+        rows = entries.index.to_numpy()
+        starts, ends = self.ops_index.offsets[rows], self.ops_index.offsets[rows + 1]
+        counts = ends - starts
+        # Positions of every op of the selected rows, concatenated: a gather, no join.
+        positions = np.repeat(starts - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts) + np.arange(counts.sum())
+        ops = {name: np.asarray(values[positions]) for name, values in self.ops_index.columns.items()}
+        return pd.DataFrame(dict({'index': np.repeat(entries['index'].to_numpy(), counts)}, **ops))
+
+    def query(self, start=None, end=None, types=None, with_ops=False):
+        entries = self.entries(start, end, types)
+        return entries, self.ops(entries) if with_ops else None
+
+
+def main(args):
+    query = OSDQuery(args.input)
+    entries, ops = query.query(args.start, args.end, args.types, with_ops=args.ops)
+    print(entries.to_csv(index=False), end='')
+    if ops is not None:
+        print(ops.to_csv(index=False), end='')
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description='query requests of a pre-processed OSD')
+    parser.add_argument('-i', '--input', metavar='input',
+                        required=True, dest='input',
+                        help='Pre-processed OSD folder.')
+    parser.add_argument('--start', type=int, default=None, dest='start',
+                        help='First timestamp (inclusive).')
+    parser.add_argument('--end', type=int, default=None, dest='end',
+                        help='Last timestamp (exclusive).')
+    parser.add_argument('--types', nargs='+', default=None, dest='types',
+                        help='Request types, as names (e.g. CEPH_MSG_OSD_OP) or indexes.')
+    parser.add_argument('--ops', action='store_true', dest='ops',
+                        help='Also print the ops of the matching requests.')
+    args = parser.parse_args(argv)
+    if args.types is not None:
+        args.types = [int(t) if t.isdigit() else t for t in args.types]
+    main(args)
+
+
+if __name__ == '__main__':
+    cli()
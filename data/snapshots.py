@@ -0,0 +1,133 @@
+import argparse
+import os
+import re
+import shutil
+import struct
+import zlib
+from pathlib import Path
+
+# Every system snapshot of an OSD is a `<timestamp>/` folder holding three small text files. The archive stores them
+# as one file of length-prefixed, zlib-compressed records followed by a (timestamp, offset) index:
+#
+#   MAGIC
+#   record*:  timestamp (int64) | compressed size (uint32) | zlib(file size (int32, -1 if missing) | bytes, ...)
+#   index:    (timestamp (int64), record offset (uint64)) * count, sorted by timestamp
+#   footer:   index offset (uint64) | count (uint64) | MAGIC
+
+ARCHIVE_FILE = 'snapshots.pack'
+SNAPSHOT_FILES = ['cpu.txt', 'mem.txt', 'disk_stats.txt']
+MAGIC = b'DQSNAP01'
+RECORD_HEADER = struct.Struct('<qI')
+FILE_HEADER = struct.Struct('<i')
+INDEX_ENTRY = struct.Struct('<qQ')
+FOOTER = struct.Struct('<QQ8s')
+
+
+def snapshot_dirs(osd_data_path):
+    return sorted((int(item.name), item) for item in Path(osd_data_path).iterdir()
+                  if item.is_dir() and re.match(r'^\d+$', item.name))
+
+
+def encode_snapshot(path):
+    payload = []
+    for name in SNAPSHOT_FILES:
+        try:
+            with open(os.path.join(path, name), 'rb') as file:
+                content = file.read()
+            payload.append(FILE_HEADER.pack(len(content)) + content)
+        except OSError:
+            payload.append(FILE_HEADER.pack(-1))
+    return zlib.compress(b''.join(payload))
+
+
+def decode_snapshot(record):
+    payload = zlib.decompress(record)
+    texts, position = [], 0
+    for _ in SNAPSHOT_FILES:
+        size, = FILE_HEADER.unpack_from(payload, position)
+        position += FILE_HEADER.size
+        if size < 0:
+            texts.append(None)
+            continue
+        texts.append(payload[position:position + size].decode())
+        position += size
+    return texts
+
+
+def pack_snapshots(osd_data_path, remove=False):
+    snapshots = snapshot_dirs(osd_data_path)
+    archive_path = os.path.join(osd_data_path, ARCHIVE_FILE)
+    index = []
+    with open(archive_path + '.tmp', 'wb') as file:
+        file.write(MAGIC)
+        for timestamp, path in snapshots:
+            index.append((timestamp, file.tell()))
+            record = encode_snapshot(path)
+            file.write(RECORD_HEADER.pack(timestamp, len(record)))
+            file.write(record)
+        index_offset = file.tell()
+        for entry in index:
+            file.write(INDEX_ENTRY.pack(*entry))
+        file.write(FOOTER.pack(index_offset, len(index), MAGIC))
+    os.replace(archive_path + '.tmp', archive_path)
+    if remove:
+        for _, path in snapshots:
+            shutil.rmtree(path)
+    return archive_path, len(snapshots)
+
+
+class SnapshotArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a snapshot archive.')
+            file.seek(-FOOTER.size, os.SEEK_END)
+            index_offset, count, magic = FOOTER.unpack(file.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f'{path} is truncated.')
+            file.seek(index_offset)
+            index = file.read(count * INDEX_ENTRY.size)
+        self.index = dict(INDEX_ENTRY.iter_unpack(index))
+        self.index_offset = index_offset
+
+    def __len__(self):
+        return len(self.index)
+
+    def timestamps(self):
+        return list(self.index.keys())
+
+    def get(self, timestamp):
+        with open(self.path, 'rb') as file:
+            file.seek(self.index[timestamp])
+            _, size = RECORD_HEADER.unpack(file.read(RECORD_HEADER.size))
+            return decode_snapshot(file.read(size))
+
+    def __iter__(self):
+        # Sequential scan: a single open() for every snapshot of the OSD.
+        with open(self.path, 'rb') as file:
+            file.seek(len(MAGIC))
+            while file.tell() < self.index_offset:
+                timestamp, size = RECORD_HEADER.unpack(file.read(RECORD_HEADER.size))
+                yield timestamp, decode_snapshot(file.read(size))
+
+
+def main(args):
+    for item in sorted(Path(args.input).rglob('data.osd*')):
+        if item.is_dir() and re.match(r'^data.osd\d+$', item.name):
+            archive_path, count = pack_snapshots(item, remove=args.remove)
+            print(f'{item}: {count} snapshots -> {archive_path} ({os.path.getsize(archive_path)} bytes)')
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description='pack raw system snapshots into one archive per OSD')
+    parser.add_argument('-i', '--input', metavar='input',
+                        required=True, dest='input',
+                        help='Raw data folder (every data.osd<N> folder below it is packed).')
+    parser.add_argument('--remove', action='store_true', dest='remove',
+                        help='Delete the snapshot folders once they are packed.')
+    main(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    cli()
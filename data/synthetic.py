@@ -0,0 +1,76 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from data.pre_process import OSD_OPS, MSG_OSD_OPS, RD, WR, DATA, assign_keys, store_exp_data
+
+# Request types and op types drawn by the generator (raw codes, mapped to indexes like pre_process does).
+ENTRY_TYPES = {42: 0.6, 112: 0.3, 113: 0.1}  # CEPH_MSG_OSD_OP, MSG_OSD_REPOP, MSG_OSD_REPOPREPLY
+OP_TYPES = {RD | DATA | 1: 0.5, WR | DATA | 1: 0.4, WR | DATA | 2: 0.1}  # read, write, writefull
+
+
+def generate_osd_trace(n_requests=100_000, seed=0, start_stamp=10 ** 15, mean_gap=50_000):
+    # Pre-processed (entries, ops, system_states) frames with plausible stamps: Poisson arrivals, exponential
+    # queue waits and log-normal service times that grow with the amount of data written.
+    rng = np.random.default_rng(seed)
+    index = np.arange(n_requests)
+    entry_types = rng.choice([MSG_OSD_OPS[code][1] for code in ENTRY_TYPES], n_requests,
+                             p=list(ENTRY_TYPES.values()))
+    recv_stamp = start_stamp + np.cumsum(rng.exponential(mean_gap, n_requests)).astype(np.int64)
+    enqueue_stamp = recv_stamp + rng.integers(1_000, 5_000, n_requests)
+    dequeue_stamp = enqueue_stamp + rng.exponential(2 * mean_gap, n_requests).astype(np.int64)
+
+    ops_len = rng.integers(1, 4, n_requests)
+    op_index = np.repeat(index, ops_len)
+    op_types = rng.choice(list(OP_TYPES.keys()), len(op_index), p=list(OP_TYPES.values()))
+    op_lengths = rng.integers(0, 1 << 20, len(op_index))
+    written = np.bincount(op_index, weights=((op_types & WR) == WR) * op_lengths, minlength=n_requests)
+    dequeue_end_stamp = dequeue_stamp + (rng.lognormal(12, 0.7, n_requests) + 0.3 * written).astype(np.int64)
+
+    entries = pd.DataFrame({
+        'index': index,
+        'type': entry_types,
+        'recv_stamp': recv_stamp,
+        'enqueue_stamp': enqueue_stamp,
+        'dequeue_stamp': dequeue_stamp,
+        'dequeue_end_stamp': dequeue_end_stamp,
+        'cost': rng.integers(1, 1 << 20, n_requests),
+        'priority': rng.choice([63, 127, 196], n_requests),
+        'owner': rng.integers(0, 16, n_requests),
+        'data_len': 0,
+        'data_off': 0,
+        'ops_len': ops_len,
+    })
+    entries['timestamp'] = entries['dequeue_stamp']
+    entries['latency'] = entries['dequeue_end_stamp'] - entries['dequeue_stamp']
+    entries.sort_values(by=['timestamp'], inplace=True)
+    ops = pd.DataFrame({
+        'index': op_index,
+        'type': [OSD_OPS[code][2] for code in op_types],
+        'len': op_lengths,
+        'off': rng.integers(0, 1 << 30, len(op_index)),
+    })
+    system_states = pd.DataFrame({'timestamp': np.arange(start_stamp, recv_stamp[-1], 10 ** 9)})
+    return entries, ops, system_states
+
+
+def write_synthetic_data(output_path, osds=1, n_requests=100_000, seed=0):
+    exp_data = {}
+    for osd_idx in range(osds):
+        entries, ops, system_states = generate_osd_trace(n_requests, seed=seed + osd_idx)
+        assign_keys({'entries': entries, 'ops': ops}, 0, osd_idx)
+        exp_data[f'osd{osd_idx}'] = {'entries': entries, 'ops': ops, 'system_states': system_states}
+    store_exp_data(exp_data, output_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='synthetic pre-processed OSD traces')
+    parser.add_argument('-o', '--output', metavar='output',
+                        required=True, dest='output',
+                        help='Output folder.')
+    parser.add_argument('-n', '--requests', type=int, default=100_000, dest='requests')
+    parser.add_argument('--osds', type=int, default=1, dest='osds')
+    parser.add_argument('--seed', type=int, default=0, dest='seed')
+    args = parser.parse_args()
+    write_synthetic_data(args.output, osds=args.osds, n_requests=args.requests, seed=args.seed)
@@ -0,0 +1,140 @@
+import argparse
+import os
+import sys
+import time
+
+from models.ionet.registry import DNN_MODELS, SKLEARN_MODELS, sklearn_model_class
+
+# Subcommands import their backends (numpy, pandas, sklearn, torch) only when they run, so short commands such as
+# predicting with a tree model do not pay for torch and pandas at startup.
+
+# Subcommands whose arguments are parsed by the module they forward to.
+FORWARDED = {
+    'pack': ('data.snapshots', 'pack raw system snapshot folders into one archive per OSD'),
+    'preprocess': ('data.pre_process', 'raw OSD traces -> pre-processed csv folders'),
+    'query': ('data.query_index', 'requests of one OSD by time range and type'),
+    'distill': ('models.ionet.distill', 'fit a small student on the predictions of a trained model'),
+    'simulate': ('simulation.admission', 'replay a trace through model-driven admission control'),
+    'experiment': ('experiment', 'run the experiment grid'),
+    'bench': ('benchmarks.inference', 'inference benchmark'),
+}
+
+
+def load_arrays(path):
+    import numpy as np
+    if os.path.isdir(path):
+        # data.featurized.FEATURES_FILE; importing that module would pull in pandas and torch.
+        path = os.path.join(path, 'features.npy')
+    return np.load(path, mmap_mode='r')
+
+
+def featurize(args):
+    from data.featurized import featurize_osd
+    featurize_osd(args.input, args.output, prune=args.prune, arrival_features=args.arrival_features)
+    print(f'featurized {args.input} -> {args.output}')
+
+
+def train(args):
+    from data.featurized import (bin_classification_datasets, featurize_frame, is_featurized, load_featurized,
+                                 load_weights)
+    if is_featurized(args.input):
+        features, latency, columns = load_featurized(args.input)
+        weights = load_weights(args.input)
+    else:
+        data, labels, _, weights = featurize_frame(args.input, prune=args.prune)
+        features, latency = data.to_numpy(dtype='float32'), labels.to_numpy(dtype='int64')
+        columns = list(data.columns)
+        weights = None if weights is None else weights.to_numpy(dtype='float32')
+    datasets = bin_classification_datasets(features, latency, args.threshold, weights=weights, columns=columns)
+
+    start = time.perf_counter()
+    if args.model in SKLEARN_MODELS:
+        model = sklearn_model_class(args.model)(None)
+        model.train_dataset, model.test_dataset = datasets[0], datasets[2]
+        model.train()
+        accuracy, _ = model.test()
+    else:
+        from models.ionet import dense_dnn
+        model = dense_dnn.IONETDenseDNN(None, model_class=getattr(dense_dnn, args.model), lr=args.lr,
+                                        batch_size=args.batch_size, datasets=datasets)
+        _, accuracy = model.train(args.epochs)
+        accuracy /= 100
+        print()
+    model.save(args.output)
+    print(f'{args.model}: test accuracy {accuracy:.4f} | {time.perf_counter() - start:.1f}s -> {args.output}')
+
+
+def predict(args):
+    import numpy as np
+    features = load_arrays(args.features)
+    if args.model.endswith('.pt'):
+        from models.ionet.dense_dnn import IONETDenseDNN
+        import torch
+        model = IONETDenseDNN.load_model(args.model)
+        with torch.no_grad():
+            predictions = np.concatenate([
+                model(torch.from_numpy(np.array(features[start:start + 4096], dtype=np.float32))).argmax(dim=1).numpy()
+                for start in range(0, len(features), 4096)])
+    else:
+        # The sklearn wrappers pickle the bare estimator, so it can be loaded without the wrapper modules.
+        import pickle
+        with open(args.model, 'rb') as file:
+            model = pickle.load(file)
+        predictions = model.predict(features)
+    if args.output is None:
+        np.savetxt(sys.stdout, predictions, fmt='%d')
+    elif args.output.endswith('.csv'):
+        np.savetxt(args.output, predictions, fmt='%d')
+    else:
+        np.save(args.output, predictions)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='deepqos', description='DeepQoS command line')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, (_, help_text) in FORWARDED.items():
+        subparsers.add_parser(command, help=help_text, add_help=False)
+
+    featurize_parser = subparsers.add_parser('featurize', help='pre-processed OSD folder -> featurized cache')
+    featurize_parser.add_argument('-i', '--input', required=True, dest='input', help='Pre-processed OSD folder.')
+    featurize_parser.add_argument('-o', '--output', required=True, dest='output', help='Featurized cache folder.')
+    featurize_parser.add_argument('--prune', action='store_true', dest='prune',
+                                  help='Drop constant and duplicate feature columns.')
+    featurize_parser.add_argument('--arrival-features', action='store_true', dest='arrival_features',
+                                  help='Only features known when a request arrives (for simulate).')
+    featurize_parser.set_defaults(handler=featurize)
+
+    train_parser = subparsers.add_parser('train', help='train and save one model')
+    train_parser.add_argument('-i', '--input', required=True, dest='input',
+                              help='Featurized cache or pre-processed OSD folder.')
+    train_parser.add_argument('-m', '--model', required=True, dest='model',
+                              choices=list(SKLEARN_MODELS.keys()) + DNN_MODELS)
+    train_parser.add_argument('-o', '--output', required=True, dest='output',
+                              help='Model path (.pkl for sklearn models, .pt for DNNs).')
+    train_parser.add_argument('-t', '--threshold', type=int, default=2_000_000, dest='threshold')
+    train_parser.add_argument('--prune', action='store_true', dest='prune')
+    train_parser.add_argument('--epochs', type=int, default=10, dest='epochs')
+    train_parser.add_argument('--batch-size', type=int, default=64, dest='batch_size')
+    train_parser.add_argument('--lr', type=float, default=0.001, dest='lr')
+    train_parser.set_defaults(handler=train)
+
+    predict_parser = subparsers.add_parser('predict', help='predict slow requests with a saved model')
+    predict_parser.add_argument('-m', '--model', required=True, dest='model', help='Saved .pkl or .pt model.')
+    predict_parser.add_argument('-f', '--features', required=True, dest='features',
+                                help='Featurized cache folder or .npy feature matrix.')
+    predict_parser.add_argument('-o', '--output', default=None, dest='output',
+                                help='Predictions (.npy or .csv, default: stdout).')
+    predict_parser.set_defaults(handler=predict)
+
+    args, forwarded_args = parser.parse_known_args(argv)
+    if args.command in FORWARDED:
+        import importlib
+        importlib.import_module(FORWARDED[args.command][0]).cli(forwarded_args)
+    elif forwarded_args:
+        parser.error(f"unrecognized arguments: {' '.join(forwarded_args)}")
+    else:
+        args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,66 +1,33 @@
-import os.path
 import argparse
-from data.dataset import IOBinClassificationDataSet
-from models.ionet.dense_dnn import IONETDenseDNN, ModelA, ModelB, ModelC, ModelD
-from models.ionet.logistic_regression import IONETLogisticRegression
-from models.ionet.decision_tree import IONETDecisionTree
-from models.ionet.random_forest import IONETRandomForest
 
-parser = argparse.ArgumentParser(description='training')
-parser.add_argument('-i', '--input', metavar='input',
-                    required=True, dest='input',
-                    help='Data folder.')
-args = parser.parse_args()
+from experiments.runner import DEFAULT_CONFIG_PATH, load_config, run
 
-data_path = args.input
-# thresh = [10_000_000, 11_000_000, 5_000_000, 5_000_000]
-thresh = [600_000, 900_000, 700_000, 500_000]
-for osd_idx in range(4):
-    path = os.path.join(data_path, f'osd{osd_idx}')
-    # train_dataset = IOBinClassificationDataSet(path, stage='train', threshold=thresh[osd_idx])
-    # test_dataset = IOBinClassificationDataSet(path, stage='test', threshold=thresh[osd_idx])
-    #
-    # try:
-    #     print(f'Regression for osd{osd_idx}')
-    #     model = IONETLogisticRegression(path)
-    #     model.train_dataset = train_dataset
-    #     model.test_dataset = test_dataset
-    #     model.train()
-    #     _, report = model.test()
-    # except Exception as e:
-    #     report = e
-    # with open(f'osd{osd_idx}_regression.txt', 'w') as file:
-    #     file.write(report)
-    #
-    # try:
-    #     print(f'Rand Forest for osd{osd_idx}')
-    #     model = IONETRandomForest(path)
-    #     model.train_dataset = train_dataset
-    #     model.test_dataset = test_dataset
-    #     model.train()
-    #     _, report = model.test()
-    # except Exception as e:
-    #     report = e
-    # with open(f'osd{osd_idx}_random_forest.txt', 'w') as file:
-    #     file.write(report)
-    #
-    # try:
-    #     print(f'Dec Tree for osd{osd_idx}')
-    #     model = IONETDecisionTree(path)
-    #     model.train_dataset = train_dataset
-    #     model.test_dataset = test_dataset
-    #     model.train()
-    #     _, report = model.test()
-    # except Exception as e:
-    #     report = e
-    # with open(f'osd{osd_idx}_dec_tree.txt', 'w') as file:
-    #     file.write(report)
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description='training')
+    parser.add_argument('-i', '--input', metavar='input',
+                        required=True, dest='input',
+                        help='Data folder.')
+    parser.add_argument('-c', '--config', metavar='config',
+                        default=DEFAULT_CONFIG_PATH, dest='config',
+                        help='Experiment grid config (json).')
+    parser.add_argument('-o', '--output', metavar='output',
+                        default='results', dest='output',
+                        help='Output folder for logs and the results table.')
+    parser.add_argument('-w', '--workers', metavar='workers', type=int,
+                        default=None, dest='workers',
+                        help='Number of worker processes (default: cores / threads per job).')
+    parser.add_argument('-t', '--threads-per-job', metavar='threads', type=int,
+                        default=1, dest='threads_per_job',
+                        help='Threads each job may use.')
+    parser.add_argument('--cache', metavar='cache',
+                        default=None, dest='cache',
+                        help='Folder for featurized OSD data (default: <output>/features).')
+    parser.add_argument('--shared-store', action='store_true', dest='shared_store',
+                        help='Publish featurized OSDs once to shared memory and map them in every job.')
+    args = parser.parse_args(argv)
+    run(load_config(args.config), args.input, args.output, workers=args.workers,
+        threads_per_job=args.threads_per_job, cache_path=args.cache, shared_store=args.shared_store)
 
-    for model_class in [ModelA, ModelB, ModelC, ModelD]:
-        with open(f'osd{osd_idx}_dnn_{model_class}.txt', 'w') as file:
-            try:
-                print(f'DNN {model_class} for osd{osd_idx}')
-                model = IONETDenseDNN(path, model_class=model_class, output=file, threshold=thresh[osd_idx])
-                model.train()
-            except Exception as e:
-                file.write(e)
+
+if __name__ == '__main__':
+    cli()
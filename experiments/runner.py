@@ -0,0 +1,216 @@
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from models.ionet.registry import DNN_MODELS, SKLEARN_MODELS, sklearn_model_class
+
+# Heavy backends (numpy, pandas, torch, sklearn) are only imported inside the workers, after the
+# thread limits below are in place.
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'configs', 'default.json')
+
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+RESULT_FIELDS = ['job_id', 'osd', 'threshold', 'kind', 'model', 'params', 'status', 'error', 'accuracy',
+                 'test_loss', 'load_seconds', 'train_seconds', 'test_seconds', 'total_seconds', 'log']
+
+
+def load_config(path):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def param_grid(params):
+    names = list(params.keys())
+    values = [value if isinstance(value, list) else [value] for value in params.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def expand_grid(config):
+    jobs = []
+    thresholds = config['thresholds']
+    dnn = config.get('dnn', {})
+    sklearn = config.get('sklearn', {})
+    for osd in config['osds']:
+        osd_thresholds = thresholds[osd] if isinstance(thresholds, dict) else thresholds
+        if not isinstance(osd_thresholds, list):
+            osd_thresholds = [osd_thresholds]
+        for threshold in osd_thresholds:
+            dnn_params = {
+                'lr': dnn.get('lr', [0.001]),
+                'batch_size': dnn.get('batch_size', [16]),
+                'epochs': dnn.get('epochs', [100]),
+            }
+            for model_class in dnn.get('model_classes', []):
+                if model_class not in DNN_MODELS:
+                    raise ValueError(f'Unknown DNN model {model_class}.')
+                for params in param_grid(dnn_params):
+                    jobs.append({'osd': osd, 'threshold': threshold, 'kind': 'dnn', 'model': model_class,
+                                 'params': params})
+            for model_name in sklearn.get('models', []):
+                if model_name not in SKLEARN_MODELS:
+                    raise ValueError(f'Unknown sklearn model {model_name}.')
+                for params in param_grid(sklearn.get('params', {}).get(model_name, {})):
+                    jobs.append({'osd': osd, 'threshold': threshold, 'kind': 'sklearn', 'model': model_name,
+                                 'params': params})
+    for job_id, job in enumerate(jobs):
+        job['job_id'] = job_id
+    return jobs
+
+
+def limit_threads(threads):
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+
+
+def featurize(osd_path, cache_path, prune=False):
+    from data.featurized import featurize_osd, is_featurized
+    if not is_featurized(cache_path):
+        featurize_osd(osd_path, cache_path, prune=prune)
+    return cache_path
+
+
+def run_job(job, featurized_path, split, output_path, threads, store_name=None):
+    start = time.perf_counter()
+    params = job['params']
+    log_path = os.path.join(output_path, f"{job['job_id']:04d}_{job['osd']}_{job['model']}_{job['threshold']}.txt")
+    result = {'job_id': job['job_id'], 'osd': job['osd'], 'threshold': job['threshold'], 'kind': job['kind'],
+              'model': job['model'], 'params': json.dumps(params, sort_keys=True), 'status': 'ok', 'error': '',
+              'accuracy': None, 'test_loss': None, 'load_seconds': None, 'train_seconds': None,
+              'test_seconds': None, 'log': log_path}
+    store = None
+    with open(log_path, 'w') as file:
+        try:
+            from data.featurized import load_featurized, load_weights, bin_classification_datasets
+            if store_name is not None:
+                from data.feature_store import FeatureStore
+                store = FeatureStore(store_name)
+                features, latency, columns, weights = store.attach()
+            else:
+                features, latency, columns = load_featurized(featurized_path)
+                weights = load_weights(featurized_path)
+            datasets = bin_classification_datasets(features, latency, job['threshold'], weights=weights,
+                                                   columns=columns, **split)
+            result['load_seconds'] = time.perf_counter() - start
+
+            if job['kind'] == 'dnn':
+                import torch
+                from models.ionet import dense_dnn
+                torch.set_num_threads(threads)
+                fit_start = time.perf_counter()
+                model = dense_dnn.IONETDenseDNN(None, model_class=getattr(dense_dnn, job['model']), lr=params['lr'],
+                                                batch_size=params['batch_size'], output=file, datasets=datasets)
+                # IONETDenseDNN.train runs the test step itself.
+                test_loss, test_acc = model.train(epochs=params['epochs'])
+                result['train_seconds'] = time.perf_counter() - fit_start
+                result['test_loss'] = test_loss
+                result['accuracy'] = test_acc / 100
+            else:
+                model = sklearn_model_class(job['model'])(None, **params)
+                model.train_dataset, _, model.test_dataset = datasets
+                fit_start = time.perf_counter()
+                model.train()
+                result['train_seconds'] = time.perf_counter() - fit_start
+                test_start = time.perf_counter()
+                accuracy, report = model.test()
+                result['test_seconds'] = time.perf_counter() - test_start
+                result['accuracy'] = accuracy
+                file.write(report)
+        except Exception as ex:
+            file.write(traceback.format_exc())
+            result['status'] = 'failed'
+            result['error'] = repr(ex)
+        finally:
+            if store is not None:
+                store.release()
+    result['total_seconds'] = time.perf_counter() - start
+    return result
+
+
+def failed_result(job, error):
+    return {'job_id': job['job_id'], 'osd': job['osd'], 'threshold': job['threshold'], 'kind': job['kind'],
+            'model': job['model'], 'params': json.dumps(job['params'], sort_keys=True), 'status': 'failed',
+            'error': error}
+
+
+def write_results(results, output_path):
+    results_path = os.path.join(output_path, 'results.csv')
+    with open(results_path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
+    return results_path
+
+
+def store_name(osd, cache_path):
+    # Distinct caches of the same OSD (e.g. pruned or not) get distinct store entries.
+    return f"{osd}_{hashlib.md5(os.path.abspath(cache_path).encode()).hexdigest()[:8]}"
+
+
+def run(config, data_path, output_path, workers=None, threads_per_job=1, cache_path=None, shared_store=False):
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+    prune = config.get('prune', False)
+    if cache_path is None:
+        cache_path = os.path.join(output_path, 'features_pruned' if prune else 'features')
+    jobs = expand_grid(config)
+    split = config.get('split', {'train_size': 0.7, 'val_size': 0.15})
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // threads_per_job)
+
+    results = []
+    # Spawned workers start without any BLAS/OpenMP runtime loaded, so the thread limits always apply.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=limit_threads,
+                             initargs=(threads_per_job,)) as executor:
+        featurized = {}
+        featurize_errors = {}
+        futures = {executor.submit(featurize, os.path.join(data_path, osd), os.path.join(cache_path, osd), prune): osd
+                   for osd in config['osds']}
+        for future in as_completed(futures):
+            osd = futures[future]
+            try:
+                featurized[osd] = future.result()
+            except Exception as ex:
+                featurize_errors[osd] = repr(ex)
+                print(f'Featurization failed for {osd}: {ex}')
+
+        # With a shared store every OSD is published to shared memory once; the parent holds a reference until all
+        # jobs are done, so the entry is freed when the run ends.
+        stores = {}
+        if shared_store:
+            from data.feature_store import FeatureStore
+            for osd, path in featurized.items():
+                stores[osd] = FeatureStore(store_name(osd, path)).publish(path)
+
+        futures = {}
+        for job in jobs:
+            if job['osd'] in featurize_errors:
+                results.append(failed_result(job, featurize_errors[job['osd']]))
+                continue
+            store = stores.get(job['osd'])
+            future = executor.submit(run_job, job, featurized[job['osd']], split, output_path, threads_per_job,
+                                     None if store is None else store.name)
+            futures[future] = job
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as ex:
+                result = failed_result(job, repr(ex))
+            results.append(result)
+            print(f"[{len(results)}/{len(jobs)}] {job['osd']} {job['model']} threshold={job['threshold']}: "
+                  f"{result['status']}")
+        for store in stores.values():
+            store.release()
+
+    results.sort(key=lambda result: result['job_id'])
+    write_results(results, output_path)
+    return results
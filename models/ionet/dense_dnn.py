@@ -6,6 +6,7 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import DataLoader
 from data.dataset import IOBinClassificationDataSet
+from utils.profiler import profiled, stage
 
 
 class DNN(nn.Module):
@@ -64,64 +65,89 @@ class ModelD(DNN):
 class IONETDenseDNN:
     def __init__(self, path, model_class: DNN = ModelA, lr=0.001, batch_size=16, shuffle=False, output=sys.stdout,
                  threshold=2_000_000,
-                 seed=42):
+                 seed=42, datasets=None, prune=False):
         self.path = path
         self.seed = seed
         self.batch_size = batch_size
         self.shuffle = shuffle
         self.output = output
         self.model = None
-        self.train_dataset = IOBinClassificationDataSet(self.path, train_size=0.7, stage='train', threshold=threshold)
-        self.val_dataset = IOBinClassificationDataSet(self.path, train_size=0.7, val_size=0.15, stage='val',
-                                                      threshold=threshold)
-        self.test_dataset = IOBinClassificationDataSet(self.path, train_size=0.7, val_size=0.15, stage='test',
-                                                       threshold=threshold)
+        if datasets is not None:
+            self.train_dataset, self.val_dataset, self.test_dataset = datasets
+        else:
+            self.train_dataset = IOBinClassificationDataSet(self.path, train_size=0.7, stage='train',
+                                                            threshold=threshold, prune=prune)
+            # Evaluation uses the columns kept for training.
+            schema = self.train_dataset.pruner
+            self.val_dataset = IOBinClassificationDataSet(self.path, train_size=0.7, val_size=0.15, stage='val',
+                                                          threshold=threshold, schema=schema)
+            self.test_dataset = IOBinClassificationDataSet(self.path, train_size=0.7, val_size=0.15, stage='test',
+                                                           threshold=threshold, schema=schema)
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model = model_class(input_size=self.train_dataset.input_size(), output_size=2).to(self.device)
         self.criterion = nn.CrossEntropyLoss()
+        # Down-sampled traces carry sampling weights, the training loss is then the weighted mean.
+        self.weighted_criterion = nn.CrossEntropyLoss(reduction='none')
+        if getattr(self.train_dataset, 'weights', None) is not None:
+            self.train_dataset.return_weights = True
         self.optimizer = optim.Adam(self.model.parameters(), lr=lr)
 
+    @profiled('IONETDenseDNN.train')
     def train(self, epochs=100):
         train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=self.shuffle)
         val_loader = DataLoader(self.val_dataset, batch_size=self.batch_size, shuffle=self.shuffle)
         test_loader = DataLoader(self.test_dataset, batch_size=self.batch_size, shuffle=self.shuffle)
         for epoch in range(epochs):
-            self.model.train()  # Set model to training mode
-            train_loss, correct, total = 0, 0, 0
-
-            for inputs, labels in train_loader:
-                inputs = torch.tensor(inputs, dtype=torch.float32)  # Convert input to tensor
-                labels = torch.tensor(labels, dtype=torch.long)
-                inputs, labels = inputs.to(self.device), labels.to(self.device)
-
-                # Forward pass
-                outputs = self.model(inputs)
-                loss = self.criterion(outputs, labels)
-
-                # Backpropagation
-                self.optimizer.zero_grad()
-                loss.backward()
-                self.optimizer.step()
-
-                # Track accuracy
-                train_loss += loss.item()
-                _, predicted = torch.max(outputs, 1)
-                total += labels.size(0)
-                correct += (predicted == labels).sum().item()
-
-            train_acc = 100 * correct / total
+            train_loss, train_acc = self.train_epoch(train_loader)
 
             # Validation step
             val_loss, val_acc = self.evaluate_model(val_loader)
 
             self.output.write(f"Epoch [{epoch + 1}/{epochs}] - "
-                              f"Train Loss: {train_loss / len(train_loader):.4f} | Train Acc: {train_acc:.2f}% - "
+                              f"Train Loss: {train_loss:.4f} | Train Acc: {train_acc:.2f}% - "
                               f"Val Loss: {val_loss:.4f} | Val Acc: {val_acc:.2f}%\n")
         self.output.write('Test Step:')
         # Test step
         test_loss, test_acc = self.evaluate_model(test_loader)
         self.output.write(f"Test Loss: {test_loss:.4f} | Test Acc: {test_acc:.2f}%")
+        return test_loss, test_acc
+
+    @profiled('IONETDenseDNN.train_epoch')
+    def train_epoch(self, train_loader):
+        self.model.train()  # Set model to training mode
+        train_loss, correct, total = 0, 0, 0
+
+        for batch in train_loader:
+            inputs, labels = batch[0], batch[1]
+            inputs = torch.as_tensor(inputs, dtype=torch.float32)  # Convert input to tensor
+            labels = torch.as_tensor(labels, dtype=torch.long)
+            inputs, labels = inputs.to(self.device), labels.to(self.device)
+
+            # Forward pass
+            with stage('IONETDenseDNN.forward'):
+                outputs = self.model(inputs)
+                if len(batch) == 3:
+                    weights = torch.as_tensor(batch[2], dtype=torch.float32).to(self.device)
+                    loss = (self.weighted_criterion(outputs, labels) * weights).sum() / weights.sum()
+                else:
+                    loss = self.criterion(outputs, labels)
+
+            # Backpropagation
+            with stage('IONETDenseDNN.backward'):
+                self.optimizer.zero_grad()
+                loss.backward()
+            with stage('IONETDenseDNN.optimizer_step'):
+                self.optimizer.step()
+
+            # Track accuracy
+            train_loss += loss.item()
+            _, predicted = torch.max(outputs, 1)
+            total += labels.size(0)
+            correct += (predicted == labels).sum().item()
 
+        return train_loss / len(train_loader), 100 * correct / total
+
+    @profiled('IONETDenseDNN.evaluate_model')
     def evaluate_model(self, dataloader):
         self.model.eval()
         loss_fn = nn.CrossEntropyLoss()
@@ -141,3 +167,29 @@ class IONETDenseDNN:
         avg_loss = total_loss / len(dataloader)
         accuracy = 100 * correct / total
         return avg_loss, accuracy
+
+    def predict(self, features, batch_size=4096):
+        self.model.eval()
+        predictions = []
+        with torch.no_grad():
+            for start in range(0, len(features), batch_size):
+                inputs = torch.as_tensor(np.asarray(features[start:start + batch_size], dtype=np.float32))
+                predictions.append(self.model(inputs.to(self.device)).argmax(dim=1).cpu().numpy())
+        return np.concatenate(predictions)
+
+    def save(self, path):
+        torch.save({
+            'model_class': type(self.model).__name__,
+            'input_size': self.model.model[0].in_features,
+            'output_size': self.model.model[-1].out_features,
+            'state_dict': self.model.state_dict(),
+        }, path)
+
+    @staticmethod
+    def load_model(path, device='cpu'):
+        checkpoint = torch.load(path, map_location=device)
+        model = globals()[checkpoint['model_class']](input_size=checkpoint['input_size'],
+                                                     output_size=checkpoint['output_size'])
+        model.load_state_dict(checkpoint['state_dict'])
+        model.eval()
+        return model
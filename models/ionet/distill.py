@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from sklearn.tree import DecisionTreeClassifier
+from torch.utils.data import DataLoader, TensorDataset
+
+from data.dataset import IOArrayDataSet
+from data.featurized import bin_classification_datasets, featurize_arrays, is_featurized, load_featurized
+from models.ionet import dense_dnn
+from models.ionet.dense_dnn import IONETDenseDNN, ModelA
+
+# Distillation: a small student is fitted on the soft predictions of a trained teacher, P(slow) softened by a
+# temperature and optionally mixed with the true labels: target = alpha * teacher + (1 - alpha) * label.
+
+
+def load_teacher(path):
+    # Returns predict_proba(features) -> P(slow) for a saved sklearn (.pkl) or DNN (.pt) model.
+    if path.endswith('.pt'):
+        model = IONETDenseDNN.load_model(path)
+
+        def predict_proba(features, batch_size=4096):
+            outputs = []
+            with torch.no_grad():
+                for start in range(0, len(features), batch_size):
+                    inputs = torch.from_numpy(np.array(features[start:start + batch_size], dtype=np.float32))
+                    outputs.append(torch.softmax(model(inputs), dim=1)[:, 1].numpy())
+            return np.concatenate(outputs)
+
+        return predict_proba
+    with open(path, 'rb') as file:
+        model = pickle.load(file)
+    return lambda features: model.predict_proba(features)[:, 1]
+
+
+def soft_targets(teacher_probabilities, labels, temperature=1.0, alpha=1.0):
+    # For two classes, softmax(logits / T) is sigmoid(logit(p) / T), so sklearn teachers soften the same way.
+    p = np.clip(np.asarray(teacher_probabilities, dtype=np.float64), 1e-6, 1 - 1e-6)
+    p = 1 / (1 + np.exp(-np.log(p / (1 - p)) / temperature))
+    return (alpha * p + (1 - alpha) * np.asarray(labels)).astype(np.float32)
+
+
+class IONETDistilledTree:
+    # Shallow tree fitted on soft targets: every row is given once as fast and once as slow, weighted by 1 - q and
+    # q, so the leaves estimate the teacher's P(slow). The saved model is a plain DecisionTreeClassifier.
+    def __init__(self, max_depth=6, min_samples_leaf=20, seed=42):
+        self.model = DecisionTreeClassifier(max_depth=max_depth, min_samples_leaf=min_samples_leaf,
+                                            random_state=seed)
+
+    def fit(self, features, targets):
+        features = np.asarray(features, dtype=np.float32)
+        self.model.fit(np.concatenate([features, features]),
+                       np.concatenate([np.zeros(len(targets), dtype=np.int64), np.ones(len(targets), dtype=np.int64)]),
+                       sample_weight=np.concatenate([1 - targets, targets]))
+
+    def predict(self, features):
+        return self.model.predict(features)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            pickle.dump(self.model, file)
+
+
+class IONETDistilledDNN(IONETDenseDNN):
+    # Small DNN trained with cross-entropy against the soft targets; saved like any IONETDenseDNN.
+    def __init__(self, datasets, model_class=ModelA, lr=0.001, batch_size=256, seed=42):
+        torch.manual_seed(seed)
+        super(IONETDistilledDNN, self).__init__(None, model_class=model_class, lr=lr, batch_size=batch_size,
+                                                seed=seed, datasets=datasets)
+
+    def fit(self, features, targets, epochs=10):
+        loader = DataLoader(TensorDataset(torch.from_numpy(np.array(features, dtype=np.float32)),
+                                          torch.from_numpy(np.column_stack([1 - targets, targets]))),
+                            batch_size=self.batch_size, shuffle=True)
+        criterion = nn.CrossEntropyLoss()  # Probability targets
+        for epoch in range(epochs):
+            self.model.train()
+            total_loss = 0
+            for inputs, soft_labels in loader:
+                loss = criterion(self.model(inputs.to(self.device)), soft_labels.to(self.device))
+                self.optimizer.zero_grad()
+                loss.backward()
+                self.optimizer.step()
+                total_loss += loss.item()
+            self.output.write(f"Epoch [{epoch + 1}/{epochs}] - Distillation Loss: {total_loss / len(loader):.4f}\n")
+
+
+def prediction_latency(predict, features, iterations=500, batch_size=1024):
+    timings = np.empty(iterations, dtype=np.int64)
+    for i in range(iterations):
+        sample = np.array(features[i % len(features)][None, :], dtype=np.float32)
+        start = time.perf_counter_ns()
+        predict(sample)
+        timings[i] = time.perf_counter_ns() - start
+    batch = np.array(features[:batch_size], dtype=np.float32)
+    start = time.perf_counter()
+    predict(batch)
+    batch_seconds = time.perf_counter() - start
+    return {
+        'single_p50_us': float(np.percentile(timings, 50)) / 1000,
+        'single_p99_us': float(np.percentile(timings, 99)) / 1000,
+        'batch_us_per_prediction': 1e6 * batch_seconds / len(batch),
+    }
+
+
+def distillation_report(teacher_predict, student_predict, features, labels, teacher_path, student_path):
+    teacher_predictions = teacher_predict(features)
+    student_predictions = student_predict(features)
+    return {
+        'teacher': dict(prediction_latency(teacher_predict, features), model_bytes=os.path.getsize(teacher_path),
+                        accuracy=float((teacher_predictions == labels).mean())),
+        'student': dict(prediction_latency(student_predict, features), model_bytes=os.path.getsize(student_path),
+                        accuracy=float((student_predictions == labels).mean())),
+        'agreement': float((teacher_predictions == student_predictions).mean()),
+    }
+
+
+def distill(train_features, train_labels, teacher_proba, student='tree', temperature=1.0, alpha=1.0,
+            max_depth=6, model_class=ModelA, epochs=10, lr=0.001, batch_size=256, datasets=None, seed=42):
+    targets = soft_targets(teacher_proba(train_features), train_labels, temperature=temperature, alpha=alpha)
+    if student == 'tree':
+        model = IONETDistilledTree(max_depth=max_depth, seed=seed)
+        model.fit(train_features, targets)
+    else:
+        if datasets is None:
+            # Only the training set is needed (it sizes the input layer): the distillation rows themselves.
+            datasets = (IOArrayDataSet(train_features, train_labels), None, None)
+        model = IONETDistilledDNN(datasets, model_class=model_class, lr=lr, batch_size=batch_size, seed=seed)
+        model.fit(train_features, targets, epochs=epochs)
+    return model
+
+
+def main(args):
+    if is_featurized(args.input):
+        features, latency, _ = load_featurized(args.input)
+    else:
+        features, latency, _ = featurize_arrays(args.input)
+    # Default split of deepqos train: the student is distilled on the training rows and both models are scored on
+    # the held-out test rows, which neither the teacher nor the student has seen.
+    datasets = bin_classification_datasets(features, latency, args.threshold)
+    train_features, train_labels = datasets[0].as_arrays()
+    test_features, test_labels = datasets[2].as_arrays()
+    print(f'distilling on {len(train_features)} rows, reporting on {len(test_features)} held-out rows')
+
+    teacher_proba = load_teacher(args.teacher)
+    start = time.perf_counter()
+    student = distill(train_features, train_labels, teacher_proba, student=args.student,
+                      temperature=args.temperature, alpha=args.alpha, max_depth=args.max_depth,
+                      model_class=getattr(dense_dnn, args.model_class), epochs=args.epochs, lr=args.lr,
+                      batch_size=args.batch_size, datasets=datasets)
+    distill_seconds = time.perf_counter() - start
+    student.save(args.output)
+
+    report = distillation_report(lambda x: (teacher_proba(x) >= 0.5).astype(np.int64), student.predict,
+                                 test_features, test_labels, args.teacher, args.output)
+    report.update(student_kind=args.student, temperature=args.temperature, alpha=args.alpha,
+                  distill_seconds=distill_seconds)
+    for name in ['teacher', 'student']:
+        result = report[name]
+        print(f"{name}: accuracy {result['accuracy']:.4f} | p50 {result['single_p50_us']:.1f}us | "
+              f"p99 {result['single_p99_us']:.1f}us | {result['batch_us_per_prediction']:.2f}us/prediction "
+              f"@ batch | {result['model_bytes'] / 1024:.1f}KiB")
+    print(f"agreement {report['agreement']:.4f}")
+    if args.report is not None:
+        with open(args.report, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description='distill a trained IONET model into a small student')
+    parser.add_argument('-i', '--input', metavar='input',
+                        required=True, dest='input',
+                        help='Featurized cache or pre-processed OSD folder.')
+    parser.add_argument('--teacher', required=True, dest='teacher',
+                        help='Saved teacher (.pkl sklearn model or .pt DNN), trained on the same features.')
+    parser.add_argument('-o', '--output', required=True, dest='output',
+                        help='Student path (.pkl for a tree, .pt for a DNN).')
+    parser.add_argument('-t', '--threshold', type=int, default=2_000_000, dest='threshold')
+    parser.add_argument('-s', '--student', choices=['tree', 'dnn'], default='tree', dest='student')
+    parser.add_argument('--temperature', type=float, default=1.0, dest='temperature')
+    parser.add_argument('--alpha', type=float, default=1.0, dest='alpha',
+                        help='Weight of the teacher in the targets (the rest is the true label).')
+    parser.add_argument('--max-depth', type=int, default=6, dest='max_depth')
+    parser.add_argument('--model-class', default='ModelA', dest='model_class')
+    parser.add_argument('--epochs', type=int, default=10, dest='epochs')
+    parser.add_argument('--lr', type=float, default=0.001, dest='lr')
+    parser.add_argument('--batch-size', type=int, default=256, dest='batch_size')
+    parser.add_argument('--report', default=None, dest='report', help='Write the report (json) here.')
+    main(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,158 @@
+import argparse
+import io
+import json
+import os
+import sys
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+
+from data.featurized import bin_classification_datasets, featurize_osd, is_featurized, load_featurized, load_weights
+from models.ionet import dense_dnn
+from models.ionet.dense_dnn import IONETDenseDNN
+
+# `batch_size` is the global batch: each of the W workers takes batch_size / W samples per step and DDP averages
+# the gradients. Without shuffling, DistributedSampler hands rank r the indices r, r + W, ..., so every step covers
+# the same samples as single-process training and produces the same checkpoint (up to float summation order; the
+# sampler pads the last batch by repeating samples when the dataset does not split evenly).
+
+
+def default_config(**overrides):
+    config = {
+        'features': None,
+        'threshold': 2_000_000,
+        'model_class': 'ModelA',
+        'lr': 0.001,
+        'batch_size': 64,
+        'epochs': 10,
+        'shuffle': False,
+        'seed': 42,
+        'threads': 1,
+        'checkpoint': None,
+        'report': None,
+        'master_addr': 'localhost',
+        'master_port': 29500,
+    }
+    config.update(overrides)
+    return config
+
+
+def train_worker(rank, world_size, config, init_method=None):
+    torch.set_num_threads(config['threads'])
+    if init_method is None:
+        init_method = f"tcp://{config['master_addr']}:{config['master_port']}"
+    dist.init_process_group('gloo', init_method=init_method, rank=rank, world_size=world_size)
+    try:
+        return train(rank, world_size, config)
+    finally:
+        dist.destroy_process_group()
+
+
+def train(rank, world_size, config):
+    if config['batch_size'] % world_size != 0:
+        raise ValueError(f"Global batch size {config['batch_size']} is not divisible by {world_size} workers.")
+    features, latency, _ = load_featurized(config['features'])
+    datasets = bin_classification_datasets(features, latency, config['threshold'],
+                                           weights=load_weights(config['features']))
+    torch.manual_seed(config['seed'])
+    output = sys.stdout if rank == 0 else io.StringIO()
+    trainer = IONETDenseDNN(None, model_class=getattr(dense_dnn, config['model_class']), lr=config['lr'],
+                            batch_size=config['batch_size'], output=output, seed=config['seed'], datasets=datasets)
+    ddp_model = DistributedDataParallel(trainer.model)
+    sampler = DistributedSampler(trainer.train_dataset, num_replicas=world_size, rank=rank,
+                                 shuffle=config['shuffle'], seed=config['seed'])
+    train_loader = DataLoader(trainer.train_dataset, batch_size=config['batch_size'] // world_size, sampler=sampler)
+    val_loader = DataLoader(trainer.val_dataset, batch_size=1024)
+
+    start = time.perf_counter()
+    for epoch in range(config['epochs']):
+        sampler.set_epoch(epoch)
+        ddp_model.train()
+        # loss sum, correct, total
+        stats = torch.zeros(3, dtype=torch.float64)
+        for batch in train_loader:
+            inputs, labels = batch[0], batch[1]
+            outputs = ddp_model(inputs)
+            if len(batch) == 3:
+                # Weighted mean over the global batch: DDP averages the W local gradients, so each worker scales
+                # its weighted sum by W over the total weight of the global batch.
+                weights = batch[2]
+                weight_sum = weights.sum().reshape(1)
+                dist.all_reduce(weight_sum)
+                loss = (trainer.weighted_criterion(outputs, labels) * weights).sum() * world_size / weight_sum[0]
+            else:
+                loss = trainer.criterion(outputs, labels)
+            trainer.optimizer.zero_grad()
+            loss.backward()  # Gradients are all-reduced (averaged) across workers here
+            trainer.optimizer.step()
+            stats += torch.tensor([loss.item() * labels.size(0), (outputs.argmax(dim=1) == labels).sum().item(),
+                                   labels.size(0)], dtype=torch.float64)
+        dist.all_reduce(stats)
+        if rank == 0:
+            # Parameters are identical on every worker, so validating on one of them is enough.
+            val_loss, val_acc = trainer.evaluate_model(val_loader)
+            output.write(f"Epoch [{epoch + 1}/{config['epochs']}] - "
+                         f"Train Loss: {stats[0] / stats[2]:.4f} | Train Acc: {100 * stats[1] / stats[2]:.2f}% - "
+                         f"Val Loss: {val_loss:.4f} | Val Acc: {val_acc:.2f}%\n")
+    train_seconds = time.perf_counter() - start
+
+    if rank == 0 and config['checkpoint'] is not None:
+        trainer.save(config['checkpoint'])
+    if rank == 0 and config['report'] is not None:
+        with open(config['report'], 'w') as file:
+            json.dump({'world_size': world_size, 'train_seconds': train_seconds,
+                       'samples': len(sampler) * world_size * config['epochs']}, file)
+    dist.barrier()
+    return train_seconds
+
+
+def launch(world_size, config):
+    # Single host: one process per worker.
+    mp.spawn(train_worker, args=(world_size, config), nprocs=world_size, join=True)
+
+
+def prepare_features(path, cache):
+    if not is_featurized(cache):
+        featurize_osd(path, cache)
+    return cache
+
+
+def main(args):
+    config = default_config(features=prepare_features(args.input, args.cache), threshold=args.threshold,
+                            model_class=args.model_class, lr=args.lr, batch_size=args.batch_size,
+                            epochs=args.epochs, shuffle=args.shuffle, threads=args.threads,
+                            checkpoint=args.checkpoint, master_addr=args.master_addr, master_port=args.master_port)
+    if 'RANK' in os.environ and 'WORLD_SIZE' in os.environ:
+        # Started by torchrun (possibly across nodes): rendezvous through MASTER_ADDR / MASTER_PORT.
+        train_worker(int(os.environ['RANK']), int(os.environ['WORLD_SIZE']), config, init_method='env://')
+    else:
+        launch(args.workers, config)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='data-parallel DNN training on CPU (gloo)')
+    parser.add_argument('-i', '--input', metavar='input',
+                        required=True, dest='input',
+                        help='Pre-processed OSD folder.')
+    parser.add_argument('--cache', required=True, dest='cache',
+                        help='Featurized cache folder shared by the workers (must be reachable from every node).')
+    parser.add_argument('-t', '--threshold', type=int, default=2_000_000, dest='threshold')
+    parser.add_argument('-w', '--workers', type=int, default=2, dest='workers',
+                        help='Worker processes on this host (ignored under torchrun).')
+    parser.add_argument('--threads', type=int, default=1, dest='threads',
+                        help='Torch threads per worker.')
+    parser.add_argument('--model-class', default='ModelA', dest='model_class')
+    parser.add_argument('--lr', type=float, default=0.001, dest='lr')
+    parser.add_argument('--batch-size', type=int, default=64, dest='batch_size',
+                        help='Global batch size, split evenly between workers.')
+    parser.add_argument('--epochs', type=int, default=10, dest='epochs')
+    parser.add_argument('--shuffle', action='store_true', dest='shuffle')
+    parser.add_argument('--checkpoint', default=None, dest='checkpoint')
+    parser.add_argument('--master-addr', default='localhost', dest='master_addr')
+    parser.add_argument('--master-port', type=int, default=29500, dest='master_port')
+    main(parser.parse_args())
@@ -0,0 +1,106 @@
+import contextlib
+import pickle
+
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.metrics import accuracy_score, classification_report
+from sklearn.pipeline import make_pipeline
+from threadpoolctl import ThreadpoolController
+
+from data.dataset import IOBinClassificationDataSet
+from models.ionet.preprocessing import RequestTypeOrdinal
+from utils.profiler import profiled
+
+
+class IONETHistGradientBoosting:
+    # Features are binned once (max_bins) before boosting and training stops early on a held-out slice. The request
+    # type is a native categorical feature: either the `req_type` column kept by load_data(), or the one-hot
+    # `req_type_<i>` block of a featurized cache, collapsed by a RequestTypeOrdinal step saved with the model.
+    # The feature names come from the dataset (DataFrame columns, or `columns` of an IOArrayDataSet).
+    # The OpenMP runtime is looked up once, on the first call that needs a thread cap.
+    def __init__(self, path, max_iter=500, learning_rate=0.1, max_leaf_nodes=63, max_bins=255, l2_regularization=0.0,
+                 validation_fraction=0.1, n_iter_no_change=20, threads=None, seed=42):
+        self.path = path
+        self.max_iter = max_iter
+        self.learning_rate = learning_rate
+        self.max_leaf_nodes = max_leaf_nodes
+        self.max_bins = max_bins
+        self.l2_regularization = l2_regularization
+        self.validation_fraction = validation_fraction
+        self.n_iter_no_change = n_iter_no_change
+        self.threads = threads
+        self.thread_controller = None
+        self.seed = seed
+        self.model = None
+        self.train_dataset = None
+        self.test_dataset = None
+        self.reset_model()
+
+    def reset_model(self):
+        self.model = HistGradientBoostingClassifier(max_iter=self.max_iter, learning_rate=self.learning_rate,
+                                                    max_leaf_nodes=self.max_leaf_nodes, max_bins=self.max_bins,
+                                                    l2_regularization=self.l2_regularization, early_stopping=True,
+                                                    validation_fraction=self.validation_fraction,
+                                                    n_iter_no_change=self.n_iter_no_change, random_state=self.seed)
+
+    def load_data(self):
+        self.train_dataset = IOBinClassificationDataSet(self.path, stage='train', type_encoding='ordinal')
+        self.test_dataset = IOBinClassificationDataSet(self.path, stage='test', type_encoding='ordinal')
+
+    def feature_columns(self):
+        columns = getattr(self.train_dataset, 'columns', None)
+        if columns is None:
+            columns = getattr(self.train_dataset.data, 'columns', None)
+        return [] if columns is None else list(columns)
+
+    def build_model(self):
+        # Returns the estimator to fit: the classifier, or a pipeline that first collapses the one-hot types.
+        classifier = self.model.steps[-1][1] if hasattr(self.model, 'steps') else self.model
+        columns = self.feature_columns()
+        type_columns = [i for i, name in enumerate(columns) if name.startswith('req_type_')]
+        if 'req_type' in columns:
+            classifier.set_params(categorical_features=[columns.index('req_type')])
+        elif type_columns:
+            classifier.set_params(categorical_features=[len(columns) - len(type_columns)])
+            return make_pipeline(RequestTypeOrdinal(type_columns), classifier)
+        else:
+            classifier.set_params(categorical_features=None)
+        return classifier
+
+    @profiled('IONETHistGradientBoosting.train')
+    def train(self):
+        X_train, y_train = self.train_dataset.as_arrays()
+        self.model = self.build_model()
+        sample_weight = getattr(self.train_dataset, 'weights', None)
+        with self.thread_limits():
+            if hasattr(self.model, 'steps'):
+                self.model.fit(X_train, y_train, histgradientboostingclassifier__sample_weight=sample_weight)
+            else:
+                self.model.fit(X_train, y_train, sample_weight=sample_weight)
+
+    @profiled('IONETHistGradientBoosting.test')
+    def test(self):
+        X_test, y_test = self.test_dataset.as_arrays()
+        y_pred = self.predict(X_test)
+        accuracy = accuracy_score(y_test, y_pred)
+        report = classification_report(y_test, y_pred)
+        return accuracy, report
+
+    def thread_limits(self):
+        # threads=None lets OpenMP use every core.
+        if self.threads is None:
+            return contextlib.nullcontext()
+        if self.thread_controller is None:
+            self.thread_controller = ThreadpoolController()
+        return self.thread_controller.limit(limits=self.threads, user_api='openmp')
+
+    def predict(self, features):
+        with self.thread_limits():
+            return self.model.predict(features)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            pickle.dump(self.model, file)
+
+    def load(self, path):
+        with open(path, 'rb') as file:
+            self.model = pickle.load(file)
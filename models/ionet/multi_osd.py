@@ -0,0 +1,102 @@
+import argparse
+import os
+import sys
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from sklearn.metrics import accuracy_score, classification_report, f1_score
+
+from data.dataset import IOMultiOSDDataSet
+from models.ionet import dense_dnn
+from models.ionet.dense_dnn import IONETDenseDNN, ModelA
+from models.ionet.registry import SKLEARN_MODELS, sklearn_model_class
+
+# Per-OSD split: every stage holds the same slice of each OSD, the test slice being the last rows of each trace.
+SPLIT = {'train_size': 0.7, 'val_size': 0.15}
+
+
+class OSDEmbeddingDNN(nn.Module):
+    # Wraps any DNN model class; the last input column is the OSD id and is replaced by its embedding.
+    def __init__(self, model_class, input_size, output_size, num_osds, embedding_dim=8):
+        super(OSDEmbeddingDNN, self).__init__()
+        self.embedding = nn.Embedding(num_osds, embedding_dim)
+        self.body = model_class(input_size=input_size - 1 + embedding_dim, output_size=output_size)
+
+    def forward(self, x):
+        osd_ids = x[:, -1].long()
+        return self.body(torch.cat([x[:, :-1], self.embedding(osd_ids)], dim=1))
+
+
+class IONETMultiOSDDenseDNN(IONETDenseDNN):
+    def __init__(self, paths, model_class: dense_dnn.DNN = ModelA, thresholds=2_000_000, embedding_dim=8, lr=0.001,
+                 batch_size=16, shuffle=False, output=sys.stdout, seed=42):
+        datasets = tuple(IOMultiOSDDataSet(paths, stage=stage, thresholds=thresholds, **SPLIT)
+                         for stage in ['train', 'val', 'test'])
+        super(IONETMultiOSDDenseDNN, self).__init__(None, model_class=model_class, lr=lr, batch_size=batch_size,
+                                                    shuffle=shuffle, output=output, seed=seed, datasets=datasets)
+        self.paths = paths
+        self.model = OSDEmbeddingDNN(model_class, input_size=self.train_dataset.input_size(), output_size=2,
+                                     num_osds=self.train_dataset.num_osds(),
+                                     embedding_dim=embedding_dim).to(self.device)
+        self.optimizer = optim.Adam(self.model.parameters(), lr=lr)
+
+
+def per_osd_metrics(y_true, y_pred, osd_ids, osd_names):
+    metrics = {}
+    for osd_id, osd_name in enumerate(osd_names):
+        mask = osd_ids == osd_id
+        if not mask.any():
+            continue
+        metrics[osd_name] = {
+            'samples': int(mask.sum()),
+            'accuracy': accuracy_score(y_true[mask], y_pred[mask]),
+            'f1_slow': f1_score(y_true[mask], y_pred[mask], zero_division=0),
+            'report': classification_report(y_true[mask], y_pred[mask], zero_division=0),
+        }
+    return metrics
+
+
+def main(args):
+    paths = [os.path.join(args.input, osd) for osd in args.osds]
+    thresholds = args.thresholds if len(args.thresholds) > 1 else args.thresholds[0]
+    if args.model == 'dnn':
+        model = IONETMultiOSDDenseDNN(paths, model_class=getattr(dense_dnn, args.model_class), thresholds=thresholds,
+                                      embedding_dim=args.embedding_dim, lr=args.lr, batch_size=args.batch_size)
+        model.train(epochs=args.epochs)
+        print()
+        X_test, y_test = model.test_dataset.as_arrays()
+        y_pred = model.predict(X_test)
+    else:
+        # Trees get the OSD as a categorical (one-hot) input.
+        model = sklearn_model_class(args.model)(None)
+        model.train_dataset = IOMultiOSDDataSet(paths, stage='train', thresholds=thresholds, osd_encoding='onehot',
+                                                **SPLIT)
+        model.test_dataset = IOMultiOSDDataSet(paths, stage='test', thresholds=thresholds, osd_encoding='onehot',
+                                               **SPLIT)
+        model.train()
+        X_test, y_test = model.test_dataset.as_arrays()
+        y_pred = model.predict(X_test)
+    print(f'All OSDs (held-out last {1 - SPLIT["train_size"] - SPLIT["val_size"]:.0%} of each OSD) - '
+          f'accuracy: {accuracy_score(y_test, y_pred):.4f}')
+    for osd_name, metrics in per_osd_metrics(y_test, y_pred, model.test_dataset.osd_ids, args.osds).items():
+        print(f"{osd_name} - samples: {metrics['samples']} | accuracy: {metrics['accuracy']:.4f} | "
+              f"slow f1: {metrics['f1_slow']:.4f}")
+        print(metrics['report'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='joint training over several OSDs')
+    parser.add_argument('-i', '--input', metavar='input',
+                        required=True, dest='input',
+                        help='Folder with the pre-processed OSD folders.')
+    parser.add_argument('--osds', nargs='+', default=['osd0', 'osd1', 'osd2', 'osd3'], dest='osds')
+    parser.add_argument('-t', '--thresholds', type=int, nargs='+', default=[2_000_000], dest='thresholds',
+                        help='One threshold for all OSDs or one per OSD.')
+    parser.add_argument('-m', '--model', choices=['dnn'] + list(SKLEARN_MODELS.keys()), default='dnn', dest='model')
+    parser.add_argument('--model-class', default='ModelA', dest='model_class')
+    parser.add_argument('--embedding-dim', type=int, default=8, dest='embedding_dim')
+    parser.add_argument('--lr', type=float, default=0.001, dest='lr')
+    parser.add_argument('--batch-size', type=int, default=16, dest='batch_size')
+    parser.add_argument('--epochs', type=int, default=100, dest='epochs')
+    main(parser.parse_args())
@@ -0,0 +1,232 @@
+import argparse
+import math
+import time
+from collections import deque
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from sklearn.linear_model import SGDClassifier
+
+from data.featurized import featurize_frame, is_featurized, load_featurized, load_weights
+from models.ionet import dense_dnn
+from models.ionet.dense_dnn import ModelA
+
+
+class ReplayBuffer:
+    # Fixed-size ring buffer of the most recent samples.
+    def __init__(self, capacity, input_size, seed=42):
+        self.capacity = capacity
+        self.features = np.zeros((capacity, input_size), dtype=np.float32)
+        self.labels = np.zeros(capacity, dtype=np.int64)
+        self.position = 0
+        self.size = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, features, labels):
+        features, labels = features[-self.capacity:], labels[-self.capacity:]
+        idx = (self.position + np.arange(len(features))) % self.capacity
+        self.features[idx] = features
+        self.labels[idx] = labels
+        self.position = (self.position + len(features)) % self.capacity
+        self.size = min(self.size + len(features), self.capacity)
+
+    def sample(self, n):
+        idx = self.rng.integers(0, self.size, size=min(n, self.size))
+        return self.features[idx], self.labels[idx]
+
+    def recent(self, n):
+        n = min(n, self.size)
+        idx = (self.position - n + np.arange(n)) % self.capacity
+        return self.features[idx], self.labels[idx]
+
+
+class DriftDetector:
+    # DDM (Gama et al. 2004) over the stream of prediction errors, updated once per micro-batch.
+    def __init__(self, warning_level=2.0, drift_level=3.0, min_samples=1000):
+        self.warning_level = warning_level
+        self.drift_level = drift_level
+        self.min_samples = min_samples
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.errors = 0
+        self.p_min = math.inf
+        self.s_min = math.inf
+        self.warning = False
+
+    def update(self, errors, samples):
+        self.samples += samples
+        self.errors += errors
+        if self.samples < self.min_samples:
+            return False
+        p = self.errors / self.samples
+        s = math.sqrt(p * (1 - p) / self.samples)
+        if p + s < self.p_min + self.s_min:
+            self.p_min, self.s_min = p, s
+        self.warning = p + s > self.p_min + self.warning_level * self.s_min
+        return p + s > self.p_min + self.drift_level * self.s_min
+
+
+class IONETOnlineLearner:
+    def __init__(self, input_size, model='dnn', model_class: dense_dnn.DNN = ModelA, lr=0.001, buffer_size=100_000,
+                 replay_size=256, steps=1, window=50, refit_size=20_000, refit_epochs=3, refit_batch_size=256,
+                 drift_detector=None, seed=42):
+        if model not in ['dnn', 'linear']:
+            raise ValueError(f'Unknown online model {model}.')
+        self.input_size = input_size
+        self.kind = model
+        self.model_class = model_class
+        self.lr = lr
+        self.replay_size = replay_size
+        self.steps = steps
+        self.refit_size = refit_size
+        self.refit_epochs = refit_epochs
+        self.refit_batch_size = refit_batch_size
+        self.seed = seed
+        self.buffer = ReplayBuffer(buffer_size, input_size, seed=seed)
+        self.drift_detector = DriftDetector() if drift_detector is None else drift_detector
+        self.window = deque(maxlen=window)
+        self.fitted = False
+        self.refits = 0
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.criterion = nn.CrossEntropyLoss()
+        self.model = None
+        self.optimizer = None
+        self.reset_model()
+
+    def reset_model(self):
+        if self.kind == 'dnn':
+            torch.manual_seed(self.seed)
+            self.model = self.model_class(input_size=self.input_size, output_size=2).to(self.device)
+            self.optimizer = optim.Adam(self.model.parameters(), lr=self.lr)
+        else:
+            self.model = SGDClassifier(loss='log_loss', alpha=1e-4, learning_rate='optimal', random_state=self.seed)
+        self.fitted = False
+
+    def predict(self, features):
+        if self.kind == 'linear':
+            return self.model.predict(features)
+        self.model.eval()
+        with torch.no_grad():
+            outputs = self.model(torch.as_tensor(features, dtype=torch.float32).to(self.device))
+        return outputs.argmax(dim=1).cpu().numpy()
+
+    def fit_step(self, features, labels):
+        if self.kind == 'linear':
+            self.model.partial_fit(features, labels, classes=np.array([0, 1]))
+            return
+        self.model.train()
+        inputs = torch.as_tensor(features, dtype=torch.float32).to(self.device)
+        targets = torch.as_tensor(labels, dtype=torch.long).to(self.device)
+        loss = self.criterion(self.model(inputs), targets)
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
+
+    def update(self, features, labels):
+        # Mix the new batch with a replay sample so one step does not forget older behavior.
+        for _ in range(self.steps):
+            if len(self.buffer) > 0 and self.replay_size > 0:
+                replay_features, replay_labels = self.buffer.sample(self.replay_size)
+                self.fit_step(np.concatenate([features, replay_features]), np.concatenate([labels, replay_labels]))
+            else:
+                self.fit_step(features, labels)
+        self.fitted = True
+
+    def refit(self):
+        # Heavier update after drift: retrain from scratch on the most recent part of the buffer.
+        features, labels = self.buffer.recent(self.refit_size)
+        self.reset_model()
+        rng = np.random.default_rng(self.seed + self.refits)
+        for _ in range(self.refit_epochs):
+            order = rng.permutation(len(features))
+            for start in range(0, len(order), self.refit_batch_size):
+                idx = order[start:start + self.refit_batch_size]
+                self.fit_step(features[idx], labels[idx])
+        self.fitted = True
+        self.refits += 1
+
+    def rolling_accuracy(self):
+        total = sum(n for _, n in self.window)
+        return sum(correct for correct, _ in self.window) / total if total else math.nan
+
+    def partial_fit(self, features, labels):
+        # Prequential evaluation: score the batch before learning from it.
+        features = np.asarray(features, dtype=np.float32)
+        labels = np.asarray(labels, dtype=np.int64)
+        drift = False
+        if self.fitted:
+            correct = int((self.predict(features) == labels).sum())
+            self.window.append((correct, len(labels)))
+            drift = self.drift_detector.update(len(labels) - correct, len(labels))
+        self.buffer.add(features, labels)
+        if drift:
+            self.refit()
+            self.drift_detector.reset()
+        else:
+            self.update(features, labels)
+        return {'accuracy': self.rolling_accuracy(), 'drift': drift, 'warning': self.drift_detector.warning}
+
+
+def iter_micro_batches(features, labels, batch_size):
+    # The featurized matrix is already in timestamp order.
+    for start in range(0, len(features), batch_size):
+        yield features[start:start + batch_size], labels[start:start + batch_size]
+
+
+def main(args):
+    if args.cache is not None and is_featurized(args.cache):
+        features, latency, _ = load_featurized(args.cache, mmap=False)
+        weights = load_weights(args.cache)
+    else:
+        data, labels, _, weights = featurize_frame(args.input)
+        features, latency = data.to_numpy(dtype=np.float32), labels.to_numpy(dtype=np.int64)
+    if weights is not None:
+        # A stratified reservoir sample is not the request stream: arrivals, class balance and drift are all
+        # distorted, so prequential accuracy and drift detection would be meaningless.
+        raise ValueError('Online training needs the full request stream, not a down-sampled trace '
+                         '(pre-processed with --sample-capacity).')
+    labels = (latency >= args.threshold).astype(np.int64)
+    learner = IONETOnlineLearner(features.shape[1], model=args.model,
+                                 model_class=getattr(dense_dnn, args.model_class), lr=args.lr,
+                                 buffer_size=args.buffer_size, replay_size=args.replay_size,
+                                 refit_size=args.refit_size)
+    processed, update_seconds = 0, 0
+    for batch, (batch_features, batch_labels) in enumerate(iter_micro_batches(features, labels, args.batch_size)):
+        start = time.perf_counter()
+        stats = learner.partial_fit(batch_features, batch_labels)
+        update_seconds += time.perf_counter() - start
+        processed += len(batch_labels)
+        if stats['drift']:
+            print(f'Drift detected at request {processed}, refit #{learner.refits}')
+        if (batch + 1) % args.log_every == 0:
+            print(f"Requests: {processed} | Rolling Acc: {100 * stats['accuracy']:.2f}% | "
+                  f"Update rate: {processed / update_seconds:.0f} req/s")
+    print(f"Processed {processed} requests in {update_seconds:.2f}s ({processed / update_seconds:.0f} req/s), "
+          f"{learner.refits} refits, final rolling accuracy {100 * learner.rolling_accuracy():.2f}%")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='online training over a request stream')
+    parser.add_argument('-i', '--input', metavar='input',
+                        required=True, dest='input',
+                        help='Pre-processed OSD folder.')
+    parser.add_argument('-t', '--threshold', type=int, default=2_000_000, dest='threshold')
+    parser.add_argument('--cache', default=None, dest='cache',
+                        help='Featurized cache folder to reuse, if present.')
+    parser.add_argument('-m', '--model', choices=['dnn', 'linear'], default='dnn', dest='model')
+    parser.add_argument('--model-class', default='ModelA', dest='model_class')
+    parser.add_argument('--lr', type=float, default=0.001, dest='lr')
+    parser.add_argument('--batch-size', type=int, default=256, dest='batch_size',
+                        help='Micro-batch size.')
+    parser.add_argument('--buffer-size', type=int, default=100_000, dest='buffer_size')
+    parser.add_argument('--replay-size', type=int, default=256, dest='replay_size')
+    parser.add_argument('--refit-size', type=int, default=20_000, dest='refit_size')
+    parser.add_argument('--log-every', type=int, default=100, dest='log_every')
+    main(parser.parse_args())
@@ -0,0 +1,21 @@
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+
+# Transformers pickled together with the models. Kept free of torch and pandas so that loading a saved .pkl model
+# stays light.
+
+
+class RequestTypeOrdinal(BaseEstimator, TransformerMixin):
+    # Collapses the one-hot `req_type_<i>` columns of a featurized matrix into one ordinal column, appended last.
+    # Rows without any type set (unknown types) get NaN, i.e. a missing category.
+    def __init__(self, type_columns):
+        self.type_columns = type_columns
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        X = np.asarray(X)
+        types = X[:, self.type_columns]
+        ordinal = np.where(types.any(axis=1), types.argmax(axis=1), np.nan)
+        return np.column_stack([np.delete(X, self.type_columns, axis=1), ordinal])
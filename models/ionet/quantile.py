@@ -0,0 +1,210 @@
+import argparse
+import sys
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from sklearn.ensemble import HistGradientBoostingRegressor
+from torch.utils.data import DataLoader
+
+from data.dataset import IOLatencyDataSet
+from models.ionet import dense_dnn
+from models.ionet.dense_dnn import IONETDenseDNN, ModelA
+
+DEFAULT_QUANTILES = [0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99]
+
+
+class PinballLoss(nn.Module):
+    def __init__(self, quantiles):
+        super(PinballLoss, self).__init__()
+        self.register_buffer('quantiles', torch.as_tensor(quantiles, dtype=torch.float32))
+
+    def forward(self, outputs, targets, weights=None):
+        errors = targets.unsqueeze(1) - outputs
+        losses = torch.max(self.quantiles * errors, (self.quantiles - 1) * errors)
+        if weights is None:
+            return losses.mean()
+        return (losses.mean(dim=1) * weights).sum() / weights.sum()
+
+
+def pinball_loss(quantile_values, targets, quantiles):
+    errors = targets[:, None] - quantile_values
+    return float(np.maximum(quantiles * errors, (quantiles - 1) * errors).mean())
+
+
+def exceedance_probability(quantile_values, quantiles, threshold):
+    # P(latency >= threshold) from predicted log1p-latency quantiles, interpolating the CDF linearly between
+    # quantile levels. Outside the predicted range the CDF is clamped to the outermost quantile levels.
+    values = np.sort(quantile_values, axis=1)  # Fix quantile crossing
+    quantiles = np.asarray(quantiles)
+    log_threshold = np.log1p(threshold)
+    upper = np.clip((values <= log_threshold).sum(axis=1), 1, values.shape[1] - 1)
+    lower = upper - 1
+    rows = np.arange(len(values))
+    low_values, high_values = values[rows, lower], values[rows, upper]
+    fraction = np.clip((log_threshold - low_values) / np.maximum(high_values - low_values, 1e-12), 0, 1)
+    cdf = quantiles[lower] + fraction * (quantiles[upper] - quantiles[lower])
+    return 1 - cdf
+
+
+def quantile_report(quantile_values, targets, quantiles, thresholds=()):
+    lines = [f'Pinball loss: {pinball_loss(quantile_values, targets, quantiles):.4f}']
+    for i, q in enumerate(quantiles):
+        coverage = (targets <= quantile_values[:, i]).mean()
+        lines.append(f'q={q:.2f} coverage: {coverage:.4f}')
+    for threshold in thresholds:
+        slow = targets >= np.log1p(threshold)
+        predicted = exceedance_probability(quantile_values, quantiles, threshold) >= 0.5
+        lines.append(f'threshold={threshold}: slow rate {slow.mean():.4f} | accuracy {(predicted == slow).mean():.4f}')
+    return '\n'.join(lines)
+
+
+class IONETQuantileDNN(IONETDenseDNN):
+    def __init__(self, path, model_class: dense_dnn.DNN = ModelA, quantiles=None, lr=0.001, batch_size=16,
+                 shuffle=False, output=sys.stdout, seed=42, datasets=None):
+        if quantiles is None:
+            quantiles = DEFAULT_QUANTILES
+        self.quantiles = np.asarray(quantiles, dtype=np.float32)
+        if datasets is None:
+            datasets = (IOLatencyDataSet(path, train_size=0.7, stage='train'),
+                        IOLatencyDataSet(path, train_size=0.7, val_size=0.15, stage='val'),
+                        IOLatencyDataSet(path, train_size=0.7, val_size=0.15, stage='test'))
+        super(IONETQuantileDNN, self).__init__(path, model_class=model_class, lr=lr, batch_size=batch_size,
+                                               shuffle=shuffle, output=output, seed=seed, datasets=datasets)
+        self.model = model_class(input_size=self.train_dataset.input_size(),
+                                 output_size=len(self.quantiles)).to(self.device)
+        # Start from the marginal quantiles of the training targets instead of zero.
+        _, train_targets = self.train_dataset.as_arrays()
+        with torch.no_grad():
+            self.model.model[-1].bias.copy_(torch.as_tensor(np.quantile(train_targets, self.quantiles)))
+        self.criterion = PinballLoss(self.quantiles).to(self.device)
+        self.optimizer = optim.Adam(self.model.parameters(), lr=lr)
+
+    def train(self, epochs=100):
+        train_loader = DataLoader(self.train_dataset, batch_size=self.batch_size, shuffle=self.shuffle)
+        val_loader = DataLoader(self.val_dataset, batch_size=self.batch_size, shuffle=self.shuffle)
+        test_loader = DataLoader(self.test_dataset, batch_size=self.batch_size, shuffle=self.shuffle)
+        for epoch in range(epochs):
+            train_loss, _ = self.train_epoch(train_loader)
+            val_loss, val_coverage = self.evaluate_model(val_loader)
+            self.output.write(f"Epoch [{epoch + 1}/{epochs}] - Train Loss: {train_loss:.4f} - "
+                              f"Val Loss: {val_loss:.4f} | Val Median Coverage: {val_coverage:.2f}%\n")
+        self.output.write('Test Step:')
+        test_loss, test_coverage = self.evaluate_model(test_loader)
+        self.output.write(f"Test Loss: {test_loss:.4f} | Test Median Coverage: {test_coverage:.2f}%")
+        return test_loss, test_coverage
+
+    def train_epoch(self, train_loader):
+        self.model.train()
+        train_loss = 0
+        for batch in train_loader:
+            inputs = torch.as_tensor(batch[0], dtype=torch.float32).to(self.device)
+            labels = torch.as_tensor(batch[1], dtype=torch.float32).to(self.device)
+            weights = torch.as_tensor(batch[2], dtype=torch.float32).to(self.device) if len(batch) == 3 else None
+            loss = self.criterion(self.model(inputs), labels, weights)
+            self.optimizer.zero_grad()
+            loss.backward()
+            self.optimizer.step()
+            train_loss += loss.item()
+        return train_loss / len(train_loader), None
+
+    def evaluate_model(self, dataloader):
+        # Returns the pinball loss and how often the target falls below the predicted median.
+        self.model.eval()
+        median = int(np.abs(self.quantiles - 0.5).argmin())
+        total_loss, below, total = 0, 0, 0
+        with torch.no_grad():
+            for inputs, labels in dataloader:
+                inputs = inputs.to(self.device)
+                labels = labels.to(self.device, dtype=torch.float32)
+                outputs = self.model(inputs)
+                total_loss += self.criterion(outputs, labels).item()
+                below += (labels <= outputs[:, median]).sum().item()
+                total += labels.size(0)
+        return total_loss / len(dataloader), 100 * below / total
+
+    def predict_quantiles(self, features, batch_size=4096):
+        self.model.eval()
+        outputs = []
+        with torch.no_grad():
+            for start in range(0, len(features), batch_size):
+                inputs = torch.as_tensor(np.asarray(features[start:start + batch_size], dtype=np.float32))
+                outputs.append(self.model(inputs.to(self.device)).cpu().numpy())
+        return np.concatenate(outputs)
+
+    def prob_exceeds(self, features, threshold):
+        return exceedance_probability(self.predict_quantiles(features), self.quantiles, threshold)
+
+
+class IONETQuantileGradientBoosting:
+    def __init__(self, path, quantiles=None, max_iter=200, learning_rate=0.1, max_leaf_nodes=31, seed=42):
+        self.path = path
+        self.quantiles = np.asarray(DEFAULT_QUANTILES if quantiles is None else quantiles)
+        self.max_iter = max_iter
+        self.learning_rate = learning_rate
+        self.max_leaf_nodes = max_leaf_nodes
+        self.seed = seed
+        self.models = None
+        self.train_dataset = None
+        self.test_dataset = None
+        self.reset_model()
+
+    def reset_model(self):
+        self.models = [HistGradientBoostingRegressor(loss='quantile', quantile=q, max_iter=self.max_iter,
+                                                     learning_rate=self.learning_rate,
+                                                     max_leaf_nodes=self.max_leaf_nodes, random_state=self.seed)
+                       for q in self.quantiles]
+
+    def load_data(self):
+        # Same split as IONETQuantileDNN, so both are scored on the same held-out rows.
+        self.train_dataset = IOLatencyDataSet(self.path, train_size=0.7, stage='train')
+        self.test_dataset = IOLatencyDataSet(self.path, train_size=0.7, val_size=0.15, stage='test')
+
+    def train(self):
+        X_train, y_train = self.train_dataset.as_arrays()
+        for model in self.models:
+            model.fit(X_train, y_train, sample_weight=getattr(self.train_dataset, 'weights', None))
+
+    def predict_quantiles(self, features):
+        return np.column_stack([model.predict(features) for model in self.models])
+
+    def prob_exceeds(self, features, threshold):
+        return exceedance_probability(self.predict_quantiles(features), self.quantiles, threshold)
+
+    def test(self, thresholds=()):
+        X_test, y_test = self.test_dataset.as_arrays()
+        quantile_values = self.predict_quantiles(X_test)
+        loss = pinball_loss(quantile_values, y_test, self.quantiles)
+        return loss, quantile_report(quantile_values, y_test, self.quantiles, thresholds)
+
+
+def main(args):
+    if args.model == 'dnn':
+        model = IONETQuantileDNN(args.input, model_class=getattr(dense_dnn, args.model_class), lr=args.lr,
+                                 batch_size=args.batch_size)
+        model.train(epochs=args.epochs)
+        X_test, y_test = model.test_dataset.as_arrays()
+        print()
+        print(quantile_report(model.predict_quantiles(X_test), y_test, model.quantiles, args.thresholds))
+    else:
+        model = IONETQuantileGradientBoosting(args.input)
+        model.load_data()
+        model.train()
+        _, report = model.test(args.thresholds)
+        print(report)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='latency quantile models')
+    parser.add_argument('-i', '--input', metavar='input',
+                        required=True, dest='input',
+                        help='Pre-processed OSD folder.')
+    parser.add_argument('-m', '--model', choices=['dnn', 'gbdt'], default='dnn', dest='model')
+    parser.add_argument('--model-class', default='ModelA', dest='model_class')
+    parser.add_argument('--lr', type=float, default=0.001, dest='lr')
+    parser.add_argument('--batch-size', type=int, default=16, dest='batch_size')
+    parser.add_argument('--epochs', type=int, default=100, dest='epochs')
+    parser.add_argument('-t', '--thresholds', type=int, nargs='*', default=[], dest='thresholds',
+                        help='SLO thresholds to evaluate with the single trained model.')
+    main(parser.parse_args())
@@ -1,8 +1,10 @@
-import numpy as np
+import pickle
+
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, classification_report
 
 from data.dataset import IOBinClassificationDataSet
+from utils.profiler import profiled
 
 
 class IONETRandomForest:
@@ -25,15 +27,26 @@ class IONETRandomForest:
         self.train_dataset = IOBinClassificationDataSet(self.path, stage='train')
         self.test_dataset = IOBinClassificationDataSet(self.path, stage='test')
 
+    @profiled('IONETRandomForest.train')
     def train(self):
-        X_train = np.array([self.train_dataset[i][0] for i in range(len(self.train_dataset))])  # Features
-        y_train = np.array([self.train_dataset[i][1] for i in range(len(self.train_dataset))])  # Labels
-        self.model.fit(X_train, y_train)
+        X_train, y_train = self.train_dataset.as_arrays()
+        self.model.fit(X_train, y_train, sample_weight=getattr(self.train_dataset, 'weights', None))
 
+    @profiled('IONETRandomForest.test')
     def test(self):
-        X_test = np.array([self.test_dataset[i][0] for i in range(len(self.test_dataset))])  # Features
-        y_test = np.array([self.test_dataset[i][1] for i in range(len(self.test_dataset))])  # Labels
+        X_test, y_test = self.test_dataset.as_arrays()
         y_pred = self.model.predict(X_test)
         accuracy = accuracy_score(y_test, y_pred)
         report = classification_report(y_test, y_pred)
         return accuracy, report
+
+    def predict(self, features):
+        return self.model.predict(features)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            pickle.dump(self.model, file)
+
+    def load(self, path):
+        with open(path, 'rb') as file:
+            self.model = pickle.load(file)
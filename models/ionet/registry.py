@@ -0,0 +1,17 @@
+import importlib
+
+# Models known to the runner, deepqos, the inference benchmark and multi-OSD training. Wrappers are imported only
+# when they are used, so the registry itself is cheap to import.
+
+SKLEARN_MODELS = {
+    'logistic_regression': ('models.ionet.logistic_regression', 'IONETLogisticRegression'),
+    'decision_tree': ('models.ionet.decision_tree', 'IONETDecisionTree'),
+    'random_forest': ('models.ionet.random_forest', 'IONETRandomForest'),
+    'hist_gradient_boosting': ('models.ionet.hist_gradient_boosting', 'IONETHistGradientBoosting'),
+}
+DNN_MODELS = ['ModelA', 'ModelB', 'ModelC', 'ModelD']
+
+
+def sklearn_model_class(name):
+    module_name, class_name = SKLEARN_MODELS[name]
+    return getattr(importlib.import_module(module_name), class_name)
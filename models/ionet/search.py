@@ -0,0 +1,162 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import sys
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from data.featurized import featurize_frame, is_featurized, load_featurized, load_weights, bin_classification_datasets
+from models.ionet import dense_dnn
+from models.ionet.dense_dnn import IONETDenseDNN
+
+DEFAULT_SEARCH_SPACE = {
+    'model_class': ['ModelA', 'ModelB', 'ModelC', 'ModelD'],
+    'lr': [0.01, 0.003, 0.001, 0.0003, 0.0001],
+    'batch_size': [16, 64, 256],
+}
+
+
+def sample_configs(search_space, n_configs=None, seed=42):
+    names = list(search_space.keys())
+    configs = [dict(zip(names, values)) for values in itertools.product(*search_space.values())]
+    if n_configs is not None and n_configs < len(configs):
+        configs = random.Random(seed).sample(configs, n_configs)
+    return configs
+
+
+class Trial:
+    def __init__(self, trial_id, config, datasets, seed=42):
+        self.trial_id = trial_id
+        self.config = config
+        self.epochs = 0
+        self.val_loss = math.inf
+        self.val_acc = 0
+        torch.manual_seed(seed)
+        self.model = IONETDenseDNN(None, model_class=getattr(dense_dnn, config['model_class']), lr=config['lr'],
+                                   batch_size=config['batch_size'], datasets=datasets, seed=seed)
+        self.train_loader = DataLoader(self.model.train_dataset, batch_size=config['batch_size'],
+                                       shuffle=self.model.shuffle)
+        self.val_loader = DataLoader(self.model.val_dataset, batch_size=1024)
+
+    def advance(self, epochs):
+        # Training resumes from the state reached in the previous rung.
+        for _ in range(epochs - self.epochs):
+            self.model.train_epoch(self.train_loader)
+        self.epochs = max(self.epochs, epochs)
+        self.val_loss, self.val_acc = self.model.evaluate_model(self.val_loader)
+
+    def summary(self):
+        return {'trial_id': self.trial_id, 'config': self.config, 'epochs': self.epochs, 'val_loss': self.val_loss,
+                'val_acc': self.val_acc}
+
+
+def successive_halving(datasets, configs, min_epochs=1, max_epochs=100, eta=3, seed=42, output=sys.stdout,
+                       first_trial_id=0):
+    trials = [Trial(first_trial_id + i, config, datasets, seed=seed) for i, config in enumerate(configs)]
+    history = []
+    budget = min_epochs
+    epochs_used = 0
+    while True:
+        for trial in trials:
+            epochs_used += max(0, budget - trial.epochs)
+            trial.advance(budget)
+        trials.sort(key=lambda t: t.val_loss)
+        history.append({'epochs': budget, 'trials': [trial.summary() for trial in trials]})
+        output.write(f"Rung {len(history)}: {len(trials)} trials at {budget} epochs - "
+                     f"best val loss {trials[0].val_loss:.4f} ({trials[0].config})\n")
+        if len(trials) == 1 or budget >= max_epochs:
+            break
+        trials = trials[:max(1, len(trials) // eta)]
+        budget = min(budget * eta, max_epochs)
+    return trials[0], history, epochs_used
+
+
+def hyperband(datasets, search_space, max_epochs=100, eta=3, seed=42, output=sys.stdout):
+    # Each bracket trades the number of configs against the budget they start with.
+    s_max = int(math.log(max_epochs) / math.log(eta) + 1e-9)
+    best, brackets, epochs_used, trial_id = None, [], 0, 0
+    for s in reversed(range(s_max + 1)):
+        n_configs = int(math.ceil((s_max + 1) / (s + 1) * eta ** s))
+        min_epochs = max(1, int(max_epochs * eta ** -s))
+        configs = sample_configs(search_space, n_configs, seed=seed + s)
+        output.write(f"Bracket s={s}: {len(configs)} configs starting at {min_epochs} epochs\n")
+        trial, history, used = successive_halving(datasets, configs, min_epochs=min_epochs, max_epochs=max_epochs,
+                                                  eta=eta, seed=seed, output=output, first_trial_id=trial_id)
+        trial_id += len(configs)
+        epochs_used += used
+        brackets.append({'s': s, 'history': history})
+        if best is None or trial.val_loss < best.val_loss:
+            best = trial
+    return best, brackets, epochs_used
+
+
+def load_datasets(path, threshold, cache=None, train_size=0.7, val_size=0.15):
+    # Sampling weights of a down-sampled trace are kept, IONETDenseDNN.train_epoch then uses the weighted loss.
+    if cache is not None and is_featurized(cache):
+        features, latency, _ = load_featurized(cache, mmap=False)
+        weights = load_weights(cache, mmap=False)
+    else:
+        data, labels, _, weights = featurize_frame(path)
+        features, latency = data.to_numpy(dtype=np.float32), labels.to_numpy(dtype=np.int64)
+        weights = None if weights is None else weights.to_numpy(dtype=np.float32)
+    return bin_classification_datasets(features, latency, threshold, train_size=train_size, val_size=val_size,
+                                       weights=weights)
+
+
+def main(args):
+    datasets = load_datasets(args.input, args.threshold, cache=args.cache)
+    search_space = DEFAULT_SEARCH_SPACE
+    if args.space is not None:
+        with open(args.space, 'r') as file:
+            search_space = json.load(file)
+    if args.method == 'hyperband':
+        best, history, epochs_used = hyperband(datasets, search_space, max_epochs=args.max_epochs, eta=args.eta,
+                                               seed=args.seed)
+        full_cost = sum(len(bracket['history'][0]['trials']) for bracket in history) * args.max_epochs
+    else:
+        configs = sample_configs(search_space, args.n_configs, seed=args.seed)
+        best, history, epochs_used = successive_halving(datasets, configs, min_epochs=args.min_epochs,
+                                                        max_epochs=args.max_epochs, eta=args.eta, seed=args.seed)
+        full_cost = len(configs) * args.max_epochs
+    print(f"Best config: {best.config} - val loss {best.val_loss:.4f} | val acc {best.val_acc:.2f}%")
+    print(f"Epochs trained: {epochs_used} ({100 * epochs_used / full_cost:.1f}% of training every config "
+          f"for {args.max_epochs} epochs)")
+    if args.output is not None:
+        if os.path.dirname(args.output) and not os.path.exists(os.path.dirname(args.output)):
+            os.makedirs(os.path.dirname(args.output))
+        with open(args.output, 'w') as file:
+            json.dump({'best': best.summary(), 'epochs_used': epochs_used, 'full_cost': full_cost,
+                       'history': history}, file, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='successive halving search over DNN configs')
+    parser.add_argument('-i', '--input', metavar='input',
+                        required=True, dest='input',
+                        help='Pre-processed OSD folder.')
+    parser.add_argument('-t', '--threshold', metavar='threshold', type=int,
+                        default=2_000_000, dest='threshold',
+                        help='Latency threshold for slow requests.')
+    parser.add_argument('--cache', metavar='cache',
+                        default=None, dest='cache',
+                        help='Featurized cache folder to reuse, if present.')
+    parser.add_argument('--space', metavar='space',
+                        default=None, dest='space',
+                        help='Search space json (lists for model_class, lr and batch_size).')
+    parser.add_argument('--method', choices=['halving', 'hyperband'],
+                        default='halving', dest='method')
+    parser.add_argument('--n-configs', type=int, default=None, dest='n_configs',
+                        help='Number of configs to sample (default: the full grid).')
+    parser.add_argument('--min-epochs', type=int, default=1, dest='min_epochs')
+    parser.add_argument('--max-epochs', type=int, default=100, dest='max_epochs')
+    parser.add_argument('--eta', type=int, default=3, dest='eta')
+    parser.add_argument('--seed', type=int, default=42, dest='seed')
+    parser.add_argument('-o', '--output', metavar='output',
+                        default=None, dest='output',
+                        help='Where to write the search history (json).')
+    main(parser.parse_args())
@@ -0,0 +1,203 @@
+import argparse
+import heapq
+import json
+import os
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from data.dataset import IODataSet
+from models.ionet.distill import load_teacher
+
+# Trace replay through a simple OSD model: requests arrive at their enqueue stamp, wait in a queue and are served by
+# `servers` parallel workers for their measured service time (dequeue_end - dequeue). A scheduling policy decides,
+# from the model's P(slow) of every request, the order of the queue and which requests are throttled or rejected:
+#
+#   fifo      arrival order, the model is not used
+#   reorder   likely-fast requests first (queue ordered by P(slow), then arrival)
+#   throttle  arrival order, but at most `slow_slots` servers run requests with P(slow) >= `slow_probability`
+#   reject    fifo, but requests with P(slow) >= `slow_probability` are rejected while `reject_queue` or more
+#             requests are waiting
+#
+# Predictions are made once, in batches, before the replay. By default they use arrival-time features only (request
+# properties and the load of earlier arrivals, see IODataSet's arrival_features), which the simulator replays as
+# recorded, so the model needs a cache featurized with --arrival-features. `recorded_features` scores full feature
+# rows instead: they hold the queue state at the recorded dequeue, which a scheduler cannot know at arrival and
+# which does not follow the simulated queue, so the policies then look better than they are.
+# The event loop merges the sorted arrivals with a heap of completions, so a replay is O(n log n).
+
+POLICIES = ['fifo', 'reorder', 'throttle', 'reject']
+PERCENTILES = [50, 90, 99, 99.9]
+STAMPS_PER_SECOND = 1_000_000_000
+
+
+def load_trace(osd_path, limit=None):
+    entries = pd.read_csv(os.path.join(osd_path, 'entries.csv'),
+                          usecols=['enqueue_stamp', 'dequeue_stamp', 'dequeue_end_stamp'])
+    order = np.argsort(entries['enqueue_stamp'].to_numpy(), kind='stable')
+    if limit is not None:
+        order = order[:limit]
+    arrivals = entries['enqueue_stamp'].to_numpy()[order]
+    service = (entries['dequeue_end_stamp'] - entries['dequeue_stamp']).to_numpy()[order]
+    recorded = (entries['dequeue_end_stamp'] - entries['enqueue_stamp']).to_numpy()[order]
+    return order, arrivals, service, recorded
+
+
+def predict_slow_probabilities(osd_path, model_path, rows, schema=None, recorded_features=False, batch_size=65536):
+    # P(slow) for the given entries rows. The features are built like the featurized cache (raw latency, full
+    # trace normalization); pass the cache's schema when the model was trained on pruned columns.
+    dataset = IODataSet(osd_path, stage='train', train_size=1.0, exclude_normalization=['latency'], schema=schema,
+                        arrival_features=not recorded_features)
+    predict_proba = load_teacher(model_path)
+    features = dataset.data.to_numpy(dtype=np.float32)
+    probabilities = np.empty(len(features))
+    for start in range(0, len(features), batch_size):
+        try:
+            probabilities[start:start + batch_size] = predict_proba(features[start:start + batch_size])
+        except (ValueError, RuntimeError) as ex:
+            kind = 'full (recorded)' if recorded_features else 'arrival-time'
+            raise ValueError(f'{model_path} does not take the {features.shape[1]} {kind} features; train it on a '
+                             f'cache featurized {"without" if recorded_features else "with"} '
+                             f'--arrival-features.') from ex
+    by_row = np.empty(len(probabilities))
+    by_row[dataset.data.index.to_numpy()] = probabilities  # The dataset is sorted by timestamp, not entries row.
+    return by_row[rows]
+
+
+def simulate(arrivals, service, slow_probabilities=None, policy='fifo', servers=8, slow_probability=0.5,
+             slow_slots=2, reject_queue=64):
+    if policy not in POLICIES:
+        raise ValueError(f'Unknown policy {policy}.')
+    if slow_probabilities is None:
+        if policy != 'fifo':
+            raise ValueError(f'Policy {policy} needs model predictions.')
+        slow_probabilities = np.zeros(len(arrivals))
+    n = len(arrivals)
+    arrivals_list, service_list = arrivals.tolist(), service.tolist()
+    probabilities = slow_probabilities.tolist()
+    slow = (slow_probabilities >= slow_probability).tolist()
+    starts, completions = [-1] * n, [-1] * n
+
+    busy = []  # (completion time, request) heap
+    slow_busy = 0
+    queue = []  # reorder: (P(slow), request) heap
+    fast_queue, slow_queue = deque(), deque()  # other policies, in arrival order
+    waiting = 0
+    i = 0
+    inf = float('inf')
+    while i < n or busy:
+        next_arrival = arrivals_list[i] if i < n else inf
+        if busy and busy[0][0] <= next_arrival:
+            now, request = heapq.heappop(busy)
+            if slow[request]:
+                slow_busy -= 1
+        else:
+            now, request = next_arrival, i
+            i += 1
+            if policy == 'reject' and slow[request] and waiting >= reject_queue:
+                continue
+            if policy == 'reorder':
+                heapq.heappush(queue, (probabilities[request], request))
+            elif policy == 'throttle' and slow[request]:
+                slow_queue.append(request)
+            else:
+                fast_queue.append(request)
+            waiting += 1
+
+        # Dispatch to free servers
+        while waiting and len(busy) < servers:
+            if policy == 'reorder':
+                _, request = heapq.heappop(queue)
+            elif slow_queue and slow_busy < slow_slots and (not fast_queue or slow_queue[0] < fast_queue[0]):
+                request = slow_queue.popleft()
+            elif fast_queue:
+                request = fast_queue.popleft()
+            else:
+                break  # Only throttled requests are waiting
+            waiting -= 1
+            if slow[request]:
+                slow_busy += 1
+            starts[request] = now
+            completions[request] = now + service_list[request]
+            heapq.heappush(busy, (completions[request], request))
+    return np.array(starts, dtype=np.int64), np.array(completions, dtype=np.int64)
+
+
+def latency_summary(latencies):
+    return {f'p{percentile:g}_us': float(value) / 1000
+            for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))}
+
+
+def simulation_report(arrivals, starts, completions):
+    done = completions >= 0
+    span = completions[done].max() - arrivals.min()
+    return dict(latency_summary(completions[done] - arrivals[done]),
+                mean_wait_us=float((starts[done] - arrivals[done]).mean()) / 1000,
+                completed=int(done.sum()), rejected=int((~done).sum()),
+                throughput=float(done.sum()) * STAMPS_PER_SECOND / span)
+
+
+def main(args):
+    rows, arrivals, service, recorded = load_trace(args.input, args.limit)
+    slow_probabilities = None
+    if args.model is not None:
+        start = time.perf_counter()
+        if args.recorded_features:
+            print('warning: scoring with recorded dequeue-time features, the policy results are optimistic')
+        slow_probabilities = predict_slow_probabilities(args.input, args.model, rows, schema=args.schema,
+                                                        recorded_features=args.recorded_features)
+        print(f'predicted {len(rows)} requests in {time.perf_counter() - start:.1f}s | '
+              f'{100 * (slow_probabilities >= args.slow_probability).mean():.1f}% likely slow')
+
+    report = {'recorded': latency_summary(recorded), 'policies': {}}
+    print(f"{'policy':<10}{'p50 us':>10}{'p90 us':>10}{'p99 us':>12}{'p99.9 us':>12}{'wait us':>10}"
+          f"{'rejected':>10}{'req/s':>10}{'replay s':>10}")
+    policies = args.policies or (POLICIES if args.model is not None else ['fifo'])
+    for policy in policies:
+        start = time.perf_counter()
+        starts, completions = simulate(arrivals, service, slow_probabilities, policy=policy, servers=args.servers,
+                                       slow_probability=args.slow_probability, slow_slots=args.slow_slots,
+                                       reject_queue=args.reject_queue)
+        result = dict(simulation_report(arrivals, starts, completions), replay_seconds=time.perf_counter() - start)
+        report['policies'][policy] = result
+        print(f"{policy:<10}{result['p50_us']:>10.1f}{result['p90_us']:>10.1f}{result['p99_us']:>12.1f}"
+              f"{result['p99.9_us']:>12.1f}{result['mean_wait_us']:>10.1f}{result['rejected']:>10}"
+              f"{result['throughput']:>10.0f}{result['replay_seconds']:>10.1f}")
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description='replay an OSD trace through model-driven admission control')
+    parser.add_argument('-i', '--input', metavar='input',
+                        required=True, dest='input',
+                        help='Pre-processed OSD folder.')
+    parser.add_argument('-m', '--model', default=None, dest='model',
+                        help='Trained model (.pkl or .pt) on arrival-time features (deepqos featurize '
+                             '--arrival-features); required by every policy but fifo.')
+    parser.add_argument('--schema', default=None, dest='schema',
+                        help='Feature schema of the model (feature_schema.json of a pruned cache).')
+    parser.add_argument('--recorded-features', action='store_true', dest='recorded_features',
+                        help='Score full recorded feature rows (queue state at the recorded dequeue) instead of '
+                             'arrival-time features; leaks information the scheduler would not have.')
+    parser.add_argument('-p', '--policies', nargs='+', choices=POLICIES, default=None, dest='policies',
+                        help='Policies to compare (default: all of them with a model, fifo without).')
+    parser.add_argument('--servers', type=int, default=8, dest='servers',
+                        help='Requests served in parallel.')
+    parser.add_argument('--slow-probability', type=float, default=0.5, dest='slow_probability',
+                        help='P(slow) from which a request is treated as slow by throttle and reject.')
+    parser.add_argument('--slow-slots', type=int, default=2, dest='slow_slots',
+                        help='Servers available to likely-slow requests (throttle).')
+    parser.add_argument('--reject-queue', type=int, default=64, dest='reject_queue',
+                        help='Queue length from which likely-slow requests are rejected (reject).')
+    parser.add_argument('-n', '--limit', type=int, default=None, dest='limit',
+                        help='Replay only the first n requests.')
+    parser.add_argument('-o', '--output', default=None, dest='output', help='Write the report (json) here.')
+    main(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,188 @@
+import atexit
+import functools
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+# Set DEEPQOS_PROFILE=<folder> to profile any entry point (worker processes included); every process writes its
+# own summary and Chrome trace there on exit.
+PROFILE_ENV_VAR = 'DEEPQOS_PROFILE'
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0
+        self.child_peak = 0
+
+    def __enter__(self):
+        stack = self.profiler.stack()
+        if self.profiler.trace_memory:
+            # Remember the parent's peak so far before resetting the tracemalloc peak for this stage.
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter_ns()
+        stack = self.profiler.stack()
+        stack.pop()
+        peak = None
+        if self.profiler.trace_memory:
+            peak = max(self.child_peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+        self.profiler.record(self.name, self.start, end, peak)
+        return False
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.max_events = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.events = []
+        self.dropped_events = 0
+        self.origin = time.perf_counter_ns()
+
+    def enable(self, trace_memory=False, max_events=1_000_000):
+        # trace_memory adds per-stage Python heap peaks (tracemalloc), at a noticeable cost.
+        self.enabled = True
+        self.trace_memory = trace_memory
+        self.max_events = max_events
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_memory = False
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.events = []
+            self.dropped_events = 0
+            self.origin = time.perf_counter_ns()
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, start, end, peak=None):
+        duration = end - start
+        # ru_maxrss is in kilobytes on Linux.
+        rss_high_water = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        with self.lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {'count': 0, 'total_ns': 0, 'max_ns': 0, 'rss_high_water_bytes': 0,
+                                           'python_peak_bytes': None}
+            stat['count'] += 1
+            stat['total_ns'] += duration
+            stat['max_ns'] = max(stat['max_ns'], duration)
+            stat['rss_high_water_bytes'] = max(stat['rss_high_water_bytes'], rss_high_water)
+            if peak is not None:
+                stat['python_peak_bytes'] = max(stat['python_peak_bytes'] or 0, peak)
+            if len(self.events) < self.max_events:
+                self.events.append((name, start, duration, threading.get_ident(), rss_high_water, peak))
+            else:
+                self.dropped_events += 1
+
+    def summary(self):
+        with self.lock:
+            stages = {}
+            for name, stat in sorted(self.stats.items(), key=lambda item: -item[1]['total_ns']):
+                stages[name] = {
+                    'count': stat['count'],
+                    'total_seconds': stat['total_ns'] / 1e9,
+                    'mean_seconds': stat['total_ns'] / stat['count'] / 1e9,
+                    'max_seconds': stat['max_ns'] / 1e9,
+                    'rss_high_water_bytes': stat['rss_high_water_bytes'],
+                    'python_peak_bytes': stat['python_peak_bytes'],
+                }
+            return {'pid': os.getpid(), 'dropped_events': self.dropped_events, 'stages': stages}
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        with self.lock:
+            events = []
+            for name, start, duration, tid, rss_high_water, peak in self.events:
+                args = {'rss_high_water_bytes': rss_high_water}
+                if peak is not None:
+                    args['python_peak_bytes'] = peak
+                events.append({'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+                               'ts': (start - self.origin) / 1000, 'dur': duration / 1000, 'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_summary(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+
+    def write(self, output_path):
+        if not os.path.exists(output_path):
+            os.makedirs(output_path, exist_ok=True)
+        pid = os.getpid()
+        self.write_summary(os.path.join(output_path, f'profile_{pid}.json'))
+        self.write_chrome_trace(os.path.join(output_path, f'trace_{pid}.json'))
+
+
+PROFILER = Profiler()
+
+
+def stage(name):
+    return PROFILER.stage(name)
+
+
+def profiled(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with _Stage(PROFILER, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable_from_env():
+    output_path = os.environ.get(PROFILE_ENV_VAR)
+    if output_path and not PROFILER.enabled:
+        PROFILER.enable(trace_memory=os.environ.get(f'{PROFILE_ENV_VAR}_MEMORY') == '1')
+        atexit.register(PROFILER.write, output_path)
+
+
+enable_from_env()